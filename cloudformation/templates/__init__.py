@@ -1,6 +1,40 @@
 import os
+import sys
+import copy
+import errno
+import hashlib
+import tempfile
+import collections
+import cPickle as pickle
 import yaml
 
+# The C (libyaml) loader is many times faster than the pure Python one
+YamlLoader = getattr(yaml, 'CLoader', yaml.Loader)
+
+# Merged per-stack configurations are cached here between runs, invalidated
+# when any of the files they were merged from changes
+CONFIG_CACHE_DIR = 'tmp/config-cache'
+# Bumped whenever merging changes, to drop configurations merged the old way
+CONFIG_CACHE_VERSION = 3
+# Lists a later configuration file replaces rather than adds to, since their
+# order matters: e.g. the IPsec proposals are listed most preferred first
+REPLACED_LISTS = [
+  ('ipsec', 'ike_proposals'),
+  ('ipsec', 'esp_proposals'),
+]
+
+# Templates are uploaded to the S3 bucket under this prefix
+TEMPLATE_PREFIX = 'infrastructure'
+# Rendered nested stack templates wait here, under their S3 key, for
+# manage-cfn to upload them with their parent
+NESTED_TEMPLATE_DIR = 'tmp/nested-templates'
+
+# filename -> (file_signature(), parsed content)
+yaml_files = {}
+# stack name -> [(config file, file_signature())], merged configuration;
+# ahead of the pickled cache, for long running processes (manage-cfn daemon)
+stack_configs = {}
+
 def config_stack(stack_name, template_name, region):
   return {
     'stack': stack_name,
@@ -19,9 +53,11 @@ def merge(a, b, path=None, update=True):
         merge(a[key], b[key], path + [str(key)])
       elif a[key] == b[key]:
         pass # same leaf value
-      elif isinstance(a[key], list) and isinstance(b[key], list):
-        # assume we don't have dictionaries inside lists
-        a[key] = list(set(a[key] + b[key]))
+      elif (isinstance(a[key], list) and isinstance(b[key], list) and
+          tuple(path + [str(key)]) not in REPLACED_LISTS):
+        # assume we don't have dictionaries inside lists; keep the order,
+        # so that the same configuration always renders the same template
+        a[key] = a[key] + [x for x in b[key] if x not in a[key]]
       elif update:
         a[key] = b[key]
       else:
@@ -31,14 +67,109 @@ def merge(a, b, path=None, update=True):
   return a
 
 
-def read_yaml_file(filename):
+def file_signature(filename):
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  return (st.st_mtime, st.st_size)
+
+
+def load_yaml_file(filename):
+  "parsed content of filename, parsed once per process as long as it doesn't"
+  "change. The result is shared between callers, DON'T MODIFY IT"
+  signature = file_signature(filename)
+  if signature is None:
+    return {}
+
+  cached = yaml_files.get(filename)
+  if cached and cached[0] == signature:
+    return cached[1]
+
   with open(filename, 'r') as f:
-    return yaml.load(f) or {}
+    content = yaml.load(f, Loader=YamlLoader) or {}
+  yaml_files[filename] = (signature, content)
+  return content
+
+
+def read_yaml_file(filename):
+  "private copy of the parsed content of filename"
+  return copy.deepcopy(load_yaml_file(filename))
+
+
+def vpcs_file():
+  "the shared parsed configuration/vpcs.yaml, DON'T MODIFY IT"
+  return load_yaml_file('configuration/vpcs.yaml')
+
+
+def eips():
+  "the shared parsed configuration/eips.yaml, DON'T MODIFY IT"
+  return load_yaml_file('configuration/eips.yaml')
+
+
+def stack_names():
+  return sorted(d for d in os.listdir('configuration/stacks') if
+    os.path.isfile(os.path.join('configuration/stacks', d, 'config.yaml')))
+
+
+def read_config_cache(stack_name):
+  "{'files': [(config file, file_signature())], 'config': configuration}"
+  try:
+    with open(os.path.join(CONFIG_CACHE_DIR, stack_name + '.pickle'), 'rb') as f:
+      cached = pickle.load(f)
+  except Exception:
+    return None
+
+  if cached.get('version') != CONFIG_CACHE_VERSION:
+    return None
+
+  if not files_unchanged(cached['files']):
+    return None
+
+  return cached
+
+
+def files_unchanged(files):
+  for filename, signature in files:
+    if file_signature(filename) != signature:
+      return False
+  return True
+
+
+def write_config_cache(stack_name, files, stack_config):
+  try:
+    os.makedirs(CONFIG_CACHE_DIR)
+  except OSError as ex:
+    if ex.errno != errno.EEXIST:
+      return
+
+  # write and rename, so concurrent readers never see a partial file
+  fd, temporary = tempfile.mkstemp(dir=CONFIG_CACHE_DIR)
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      pickle.dump({'version': CONFIG_CACHE_VERSION, 'files': files,
+        'config': stack_config}, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporary, os.path.join(CONFIG_CACHE_DIR, stack_name + '.pickle'))
+  except Exception:
+    os.remove(temporary)
 
 
 def config(stack_name):
+  cached = stack_configs.get(stack_name)
+  if cached is None or not files_unchanged(cached['files']):
+    cached = read_config_cache(stack_name)
+  if cached is not None:
+    stack_configs[stack_name] = cached
+    # callers are free to modify their configuration
+    return copy.deepcopy(cached['config'])
+
+  stack_file = "configuration/stacks/%s/config.yaml" % stack_name
+  if not os.path.exists(stack_file):
+    sys.stderr.write('%s: not found\n' % stack_file)
+    sys.exit(1)
+
   # Read the stack configuration just to get the template and region name
-  stack = read_yaml_file("configuration/stacks/%s/config.yaml" % stack_name)
+  stack = load_yaml_file(stack_file)
   template_name = stack['template_name'] if 'template_name' in stack else None
   region = stack['region'] if 'region' in stack else None
 
@@ -47,11 +178,56 @@ def config(stack_name):
   config_files = [
     "configuration/templates/config.yaml",
     "configuration/templates/%s/config.yaml" % template_name,
-    "configuration/stacks/%s/config.yaml" % stack_name,
+    stack_file,
   ]
 
   for config_file in config_files:
     if os.path.exists(config_file):
       stack_config = merge(stack_config, read_yaml_file(config_file))
 
+  # missing files are recorded too, creating one invalidates the cache
+  files = [(config_file, file_signature(config_file))
+    for config_file in config_files]
+  write_config_cache(stack_name, files, stack_config)
+  stack_configs[stack_name] = {'files': files,
+    'config': copy.deepcopy(stack_config)}
+
   return stack_config
+
+
+def configs(names=None):
+  "configuration of all the stacks (or of 'names') by stack name"
+  return collections.OrderedDict((stack_name, config(stack_name))
+    for stack_name in (names or stack_names()))
+
+
+def template_key(stack_name, body):
+  # Content addressed: re-uploading an identical template is a no-op
+  digest = hashlib.sha256(body).hexdigest()
+  return '%s/%s/%s.json' % (TEMPLATE_PREFIX, stack_name, digest)
+
+
+def template_url(config, key):
+  return 'https://s3.amazonaws.com/%s/%s' % (config['s3_bucket'], key)
+
+
+def nested_template(config, body):
+  """TemplateURL of a nested stack of config's stack whose template is
+  'body'. It is uploaded by manage-cfn along with its parent, until then it
+  is kept under NESTED_TEMPLATE_DIR."""
+  key = template_key(config['stack'] + '/nested', body)
+  filename = os.path.join(NESTED_TEMPLATE_DIR, key)
+
+  if not os.path.exists(filename):
+    try:
+      os.makedirs(os.path.dirname(filename))
+    except OSError as ex:
+      if ex.errno != errno.EEXIST:
+        raise
+    # write and rename, so concurrent renders never upload a partial file
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'w') as f:
+      f.write(body)
+    os.rename(temporary, filename)
+
+  return template_url(config, key)
@@ -0,0 +1,219 @@
+"""IPv4 CIDR arithmetic for vpcs.yaml and the VPC subnets.
+
+Pure Python, the 'ipaddress' module is Python 3 only. Blocks are handled as
+(first, last) address integers, so checking n blocks for overlaps is a sort
+and a single sweep: O(n log n).
+"""
+
+import sys
+
+import templates
+
+# Smallest and largest subnets AWS allows in a VPC
+SUBNET_MIN_PREFIX_LENGTH = 16
+SUBNET_MAX_PREFIX_LENGTH = 28
+
+
+def parse(cidr):
+    """(first address, prefix length) of 'cidr' as integers. Raises
+    ValueError if it isn't a valid network address."""
+    try:
+        address, prefix_length = str(cidr).split('/')
+        prefix_length = int(prefix_length)
+        octets = [int(x) for x in address.split('.')]
+    except ValueError:
+        raise ValueError('%s: not a CIDR' % cidr)
+
+    if (len(octets) != 4 or not 0 <= prefix_length <= 32 or
+            [x for x in octets if not 0 <= x <= 255]):
+        raise ValueError('%s: not a CIDR' % cidr)
+
+    first = (octets[0] << 24) | (octets[1] << 16) | (octets[2] << 8) | octets[3]
+    if first & (size(prefix_length) - 1):
+        raise ValueError('%s: host bits set' % cidr)
+
+    return first, prefix_length
+
+
+def size(prefix_length):
+    return 1 << (32 - prefix_length)
+
+
+def block(cidr):
+    first, prefix_length = parse(cidr)
+    return first, first + size(prefix_length) - 1
+
+
+def format_cidr(first, prefix_length):
+    return '%d.%d.%d.%d/%d' % (first >> 24, (first >> 16) & 255,
+        (first >> 8) & 255, first & 255, prefix_length)
+
+
+def overlaps(cidrs):
+    """List of (a, b) pairs of overlapping labels from [(cidr, label)].
+
+    Every block which overlaps any other is in at least one pair (paired
+    with the earlier block reaching furthest), which is enough to report
+    them without comparing every pair."""
+    blocks = sorted((block(cidr) + (label,) for cidr, label in cidrs),
+        key=lambda x: (x[0], -x[1]))
+
+    result = []
+    previous = None
+    for first, last, label in blocks:
+        if previous and first <= previous[1]:
+            result.append((previous[2], label))
+        if not previous or last > previous[1]:
+            previous = (first, last, label)
+
+    return result
+
+
+def collapse(cidrs):
+    """The fewest CIDRs which cover exactly the addresses of 'cidrs', in
+    address order: overlapping and adjacent blocks are merged, and each
+    merged range is split into the largest aligned blocks it holds."""
+    merged = []
+    for first, last in sorted(block(cidr) for cidr in cidrs):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    result = []
+    for first, last in merged:
+        while first <= last:
+            prefix_length = 32
+            while (prefix_length > 0 and
+                    not first & (size(prefix_length - 1) - 1) and
+                    first + size(prefix_length - 1) - 1 <= last):
+                prefix_length -= 1
+            result.append(format_cidr(first, prefix_length))
+            first += size(prefix_length)
+
+    return result
+
+
+def allocate(pool, prefix_length, used):
+    """First free /prefix_length block in 'pool' which doesn't overlap any
+    of the 'used' CIDRs, None if the pool is full."""
+    pool_first, pool_last = block(pool)
+    if prefix_length < parse(pool)[1] or prefix_length > 32:
+        raise ValueError('/%d: doesn\'t fit in %s' % (prefix_length, pool))
+    length = size(prefix_length)
+
+    candidate = pool_first
+    for first, last in sorted(block(cidr) for cidr in used):
+        if last < candidate:
+            continue
+        if candidate + length - 1 < first:
+            break
+        # align the next candidate to the block size
+        candidate = (last + length) & ~(length - 1)
+        if candidate > pool_last:
+            return None
+
+    if candidate + length - 1 > pool_last:
+        return None
+
+    return format_cidr(candidate, prefix_length)
+
+
+def derive_subnets(vpc_cidr, zones, private=True):
+    """Subnet configurations splitting 'vpc_cidr' evenly between a public
+    (and a private) subnet in each of the availability 'zones', in the
+    format of the 'subnets' stack configuration."""
+    kinds = [True, False] if private else [True]
+    count = len(zones) * len(kinds)
+    if not count:
+        raise ValueError('%s: no zones to derive subnets for' % vpc_cidr)
+
+    first, prefix_length = parse(vpc_cidr)
+    bits = 0
+    while (1 << bits) < count:
+        bits += 1
+    prefix_length += bits
+    if prefix_length > SUBNET_MAX_PREFIX_LENGTH:
+        raise ValueError('%s: too small for %d subnets' % (vpc_cidr, count))
+
+    subnets = []
+    for public in kinds:
+        for zone in zones:
+            subnets.append({
+                'zone': zone,
+                'cidr': format_cidr(first, prefix_length),
+                'public': public,
+            })
+            first += size(prefix_length)
+
+    return subnets
+
+
+def vpc_errors(vpcs):
+    """Problems with the 'cidr' of the vpcs.yaml 'vpcs'."""
+    errors = []
+    cidrs = []
+    for name in sorted(vpcs):
+        if 'cidr' not in vpcs[name]:
+            errors.append('%s: no cidr' % name)
+            continue
+        try:
+            parse(vpcs[name]['cidr'])
+        except ValueError as ex:
+            errors.append('%s: %s' % (name, ex))
+            continue
+        cidrs.append((vpcs[name]['cidr'], name))
+
+    for a, b in overlaps(cidrs):
+        errors.append('%s (%s) overlaps %s (%s)' % (b, vpcs[b]['cidr'],
+            a, vpcs[a]['cidr']))
+
+    return errors
+
+
+def subnet_errors(vpc_cidr, subnets):
+    """Problems with 'subnets' (in the format of the 'subnets' stack
+    configuration) of a VPC whose CIDR is 'vpc_cidr'."""
+    errors = []
+    cidrs = []
+    vpc_first, vpc_last = block(vpc_cidr)
+    for subnet in subnets:
+        label = '%s (%s)' % (subnet['cidr'], subnet['zone'])
+        try:
+            first, prefix_length = parse(subnet['cidr'])
+        except ValueError as ex:
+            errors.append('subnet %s' % ex)
+            continue
+
+        if not (SUBNET_MIN_PREFIX_LENGTH <= prefix_length <=
+                SUBNET_MAX_PREFIX_LENGTH):
+            errors.append('subnet %s: prefix length must be between /%d and '
+                '/%d' % (label, SUBNET_MIN_PREFIX_LENGTH,
+                SUBNET_MAX_PREFIX_LENGTH))
+        if first < vpc_first or block(subnet['cidr'])[1] > vpc_last:
+            errors.append('subnet %s: not within the VPC\'s %s' %
+                (label, vpc_cidr))
+        cidrs.append((subnet['cidr'], label))
+
+    for a, b in overlaps(cidrs):
+        errors.append('subnet %s overlaps %s' % (b, a))
+
+    return errors
+
+
+checked = None
+
+
+def check_vpcs_file():
+    """Exits if the CIDRs in configuration/vpcs.yaml overlap, checked once
+    for as long as the file doesn't change."""
+    global checked
+
+    vpcs_file = templates.vpcs_file()
+    if checked is not vpcs_file:
+        errors = vpc_errors(vpcs_file.get('vpcs') or {})
+        if errors:
+            for error in errors:
+                sys.stderr.write('configuration/vpcs.yaml: %s\n' % error)
+            sys.exit(1)
+        checked = vpcs_file
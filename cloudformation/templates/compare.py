@@ -0,0 +1,167 @@
+"""Structural comparison of two CloudFormation templates.
+
+Every resource (and every other top level section entry) is hashed first,
+so only the subtrees which actually differ are walked: comparing two large
+templates is linear in their size.
+
+diff_templates() returns a JSON serialisable report:
+
+    {
+      "changed": true,
+      "resources": {
+        "added": [{"id": "NewCGW", "type": "AWS::EC2::CustomerGateway"}],
+        "removed": [...],
+        "modified": [{
+          "id": "AutoScalingGroup",
+          "type": "AWS::AutoScaling::AutoScalingGroup",
+          "changes": [{"path": "Properties.Tags[2].Value",
+                       "old": "1", "new": "2"}]
+        }]
+      },
+      "sections": {"Outputs": {"added": [...], "removed": [...],
+                               "modified": [...]}}
+    }
+
+A change has no "old" (or "new") when the key or list item is missing on
+that side, which is not the same as an explicit null.
+"""
+
+import json
+import hashlib
+
+SECTIONS = ['Parameters', 'Mappings', 'Conditions', 'Outputs']
+
+# Marks a value missing on one side of a change
+MISSING = object()
+
+
+def subtree_hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True,
+        separators=(',', ':'))).hexdigest()
+
+
+def join_path(path, key):
+    if isinstance(key, int):
+        return '%s[%d]' % (path, key)
+    return '%s.%s' % (path, key) if path else key
+
+
+def diff_values(old, new, path=''):
+    """List of {'path', 'old', 'new'} for every leaf which differs, without
+    'old' or 'new' where the value is MISSING."""
+    if old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new)):
+            changes.extend(diff_values(old.get(key, MISSING),
+                new.get(key, MISSING), join_path(path, key)))
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        changes = []
+        for index in range(max(len(old), len(new))):
+            changes.extend(diff_values(
+                old[index] if index < len(old) else MISSING,
+                new[index] if index < len(new) else MISSING,
+                join_path(path, index)))
+        return changes
+
+    change = {'path': path}
+    if old is not MISSING:
+        change['old'] = old
+    if new is not MISSING:
+        change['new'] = new
+    return [change]
+
+
+def diff_section(old, new, describe):
+    old = old or {}
+    new = new or {}
+
+    old_hashes = dict((key, subtree_hash(value)) for key, value in old.items())
+    new_hashes = dict((key, subtree_hash(value)) for key, value in new.items())
+
+    result = {
+        'added': [describe(key, new[key])
+            for key in sorted(set(new) - set(old))],
+        'removed': [describe(key, old[key])
+            for key in sorted(set(old) - set(new))],
+        'modified': [],
+    }
+
+    for key in sorted(set(old) & set(new)):
+        if old_hashes[key] != new_hashes[key]:
+            modified = describe(key, new[key])
+            modified['changes'] = diff_values(old[key], new[key])
+            result['modified'].append(modified)
+
+    return result
+
+
+def describe_resource(logical_id, resource):
+    return {'id': logical_id, 'type': resource.get('Type')}
+
+
+def describe_entry(key, value):
+    return {'id': key}
+
+
+def diff_templates(old, new):
+    report = {
+        'resources': diff_section(old.get('Resources'), new.get('Resources'),
+            describe_resource),
+        'sections': {},
+    }
+
+    for section in SECTIONS:
+        changes = diff_section(old.get(section), new.get(section),
+            describe_entry)
+        if changes['added'] or changes['removed'] or changes['modified']:
+            report['sections'][section] = changes
+
+    other = diff_values(
+        dict((k, v) for k, v in old.items() if k not in SECTIONS + ['Resources']),
+        dict((k, v) for k, v in new.items() if k not in SECTIONS + ['Resources']))
+    if other:
+        report['sections']['Template'] = {'added': [], 'removed': [],
+            'modified': [{'id': 'Template', 'changes': other}]}
+
+    resources = report['resources']
+    report['changed'] = bool(resources['added'] or resources['removed'] or
+        resources['modified'] or report['sections'])
+
+    return report
+
+
+def format_value(value):
+    if value is MISSING:
+        return '(none)'
+    text = json.dumps(value, sort_keys=True)
+    return text if len(text) <= 80 else text[:77] + '...'
+
+
+def format_report(report, name):
+    """Human readable rendering of a diff_templates() report."""
+    resources = report['resources']
+    lines = ['%s: %d resources added, %d removed, %d modified' % (name,
+        len(resources['added']), len(resources['removed']),
+        len(resources['modified']))]
+
+    sections = [('Resources', resources)] + sorted(report['sections'].items())
+    for section, changes in sections:
+        for sign, kind in (('+', 'added'), ('-', 'removed'), ('~', 'modified')):
+            for entry in changes[kind]:
+                line = '%s %s %s' % (sign, section, entry['id'])
+                if entry.get('type'):
+                    line += ' (%s)' % entry['type']
+                if entry.get('replacement'):
+                    line += ' [replacement: %s]' % entry['replacement']
+                lines.append(line)
+                for change in entry.get('changes', []):
+                    lines.append('    %s: %s -> %s' % (change['path'],
+                        format_value(change.get('old', MISSING)),
+                        format_value(change.get('new', MISSING))))
+
+    return '\n'.join(lines)
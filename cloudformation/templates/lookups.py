@@ -0,0 +1,197 @@
+"""AWS lookups made while rendering templates (VPC id's, route tables,
+subnets).
+
+A lookup is resolved from, in order:
+
+1. The lockfile, configuration/lookups.yaml, written by
+   "manage-cfn lock-lookups". With it in place renders are offline and
+   reproducible.
+2. The cache, tmp/lookups-cache.json, whose entries expire after CACHE_TTL
+   seconds.
+3. AWS, reusing one connection per region and thread.
+
+Setting 'refresh' (manage-cfn --refresh-lookups) skips 1 and 2.
+
+Lookups are resolved concurrently, only the lockfile and cache accesses are
+serialised. Concurrent lookups of the same key wait for the first one
+rather than asking AWS again. The cache is shared between processes: each
+new entry is merged into the file as it is now, under a file lock.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import tempfile
+import threading
+import contextlib
+import yaml
+
+import templates
+
+LOCKFILE = 'configuration/lookups.yaml'
+CACHE_FILE = 'tmp/lookups-cache.json'
+CACHE_LOCK_FILE = CACHE_FILE + '.lock'
+CACHE_TTL = 3600
+
+refresh = False
+
+# every lookup resolved by this process, written out by write_lockfile()
+resolved = {}
+
+# boto connections aren't thread safe, {region: connection} per thread
+connections = threading.local()
+cache = None
+cache_signature = None
+# guards the lockfile, the cache and 'resolved', never held while resolving
+lock = threading.RLock()
+# lookup key -> lock held while resolving it
+key_locks = {}
+# the dictionaries of this thread's active recording()'s
+recorders = threading.local()
+
+
+def connection(region):
+    # boto is only imported when a lookup isn't locked or cached
+    import boto.vpc
+
+    regions = connections.__dict__
+    if region not in regions:
+        regions[region] = boto.vpc.connect_to_region(region)
+    return regions[region]
+
+
+def lookup_key(region, kind, name, filters=None):
+    key = '%s/%s/%s' % (region, kind, name)
+    if filters:
+        key += '?' + '&'.join('%s=%s' % (k, filters[k]) for k in sorted(filters))
+    return key
+
+
+def read_cache():
+    global cache, cache_signature
+
+    # re-read if another process (e.g. another manage-cfn) wrote it
+    signature = templates.file_signature(CACHE_FILE)
+    if cache is None or signature != cache_signature:
+        try:
+            with open(CACHE_FILE) as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+        cache_signature = signature
+
+    return cache
+
+
+def update_cache(key, value):
+    """Add 'key' to the cache file, keeping the entries other processes
+    wrote since it was read."""
+    global cache, cache_signature
+
+    directory = os.path.dirname(CACHE_FILE)
+    try:
+        os.makedirs(directory)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+    with lock:
+        with open(CACHE_LOCK_FILE, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # the file as it is now, its signature may not have changed
+                cache = None
+                read_cache()[key] = {'value': value, 'time': time.time()}
+
+                fd, temporary = tempfile.mkstemp(dir=directory)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(cache, f, sort_keys=True, indent=2)
+                os.rename(temporary, CACHE_FILE)
+                cache_signature = templates.file_signature(CACHE_FILE)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def stored(key):
+    """(True, value) of 'key' if the lockfile or an unexpired cache entry
+    has it, else (False, None). Never asks AWS."""
+    if refresh:
+        return False, None
+
+    with lock:
+        locked = templates.load_yaml_file(LOCKFILE)
+        if key in locked:
+            return True, locked[key]
+
+        cached = read_cache().get(key)
+        if cached and time.time() - cached['time'] < CACHE_TTL:
+            return True, cached['value']
+
+    return False, None
+
+
+def lookup(region, kind, name, resolve, filters=None):
+    """Value of lookup 'kind' of 'name' in 'region', calling
+    resolve(connection) only if neither the lockfile nor the cache has it."""
+    key = lookup_key(region, kind, name, filters)
+
+    found, value = stored(key)
+    if not found:
+        with lock:
+            key_lock = key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # another thread may have resolved it while this one waited
+            with lock:
+                found = refresh and key in resolved
+                value = resolved.get(key)
+            if not found:
+                found, value = stored(key)
+            if not found:
+                value = resolve(connection(region))
+                update_cache(key, value)
+
+    with lock:
+        resolved[key] = value
+    for used in getattr(recorders, 'stack', []):
+        used[key] = value
+
+    return value
+
+
+@contextlib.contextmanager
+def recording():
+    """Yields a dictionary which collects the {key: value} of every lookup
+    this thread makes until the block ends."""
+    used = {}
+    stack = recorders.__dict__.setdefault('stack', [])
+    stack.append(used)
+    try:
+        yield used
+    finally:
+        stack.remove(used)
+
+
+def unchanged(used):
+    """True if the lockfile or the cache still have the values of the
+    recording()'s 'used' lookups, so a render with them would see the same
+    values. Never asks AWS."""
+    return all(stored(key) == (True, value) for key, value in used.items())
+
+
+def write_lockfile():
+    with lock:
+        locked = templates.read_yaml_file(LOCKFILE)
+        locked.update(resolved)
+
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(LOCKFILE))
+        with os.fdopen(fd, 'w') as f:
+            f.write('# AUTO GENERATED BY bin/manage-cfn lock-lookups, '
+                'EDITS WILL BE LOST\n')
+            yaml.safe_dump(locked, f, default_flow_style=False)
+        os.rename(temporary, LOCKFILE)
+
+    return len(resolved)
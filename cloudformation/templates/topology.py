@@ -0,0 +1,111 @@
+"""The WAN topology described by the 'connections' in configuration/vpcs.yaml.
+
+The connections are indexed once, so that every question a template (or
+manage-cfn) asks about the graph is a dictionary lookup rather than a scan of
+all the connections:
+
+    incoming    hub -> the VPC's which connect to it, in configuration order
+    outgoing    spoke -> the hubs it connects to, in configuration order
+    hubs        the VPC's with incoming connections (they get a VGW)
+    spokes      the VPC's with outgoing connections (they get VyOS routers)
+    cgw_hubs    (hub region, spoke) -> the hubs in that region which expect a
+                CGW for the spoke's public IP
+
+validate() enforces the rules described at the top of vpcs.yaml and
+router_slice() is the part of the topology a spoke's routers need, which is
+shipped to them in the user data as topology.json.
+"""
+
+import sys
+import json
+import collections
+
+import templates
+
+
+def vpc_name(entry):
+    # 'to'/'from' entries in vpcs.yaml are either names or one-key dicts
+    return entry.keys()[0] if isinstance(entry, dict) else entry
+
+
+def append_once(index, key, value):
+    if value not in index[key]:
+        index[key].append(value)
+
+
+class Topology(object):
+    def __init__(self, vpcs_file):
+        self.source = vpcs_file
+        self.vpcs = vpcs_file.get('vpcs') or {}
+        self.incoming = collections.defaultdict(list)
+        self.outgoing = collections.defaultdict(list)
+        self.cgw_hubs = collections.defaultdict(list)
+
+        connections = vpcs_file.get('connections') or {}
+        for connection_name in sorted(connections):
+            connection = connections[connection_name] or {}
+            hubs = [vpc_name(x) for x in connection.get('to') or []]
+            spokes = [vpc_name(x) for x in connection.get('from') or []]
+
+            for hub in hubs:
+                region = self.vpcs.get(hub, {}).get('region')
+                for spoke in spokes:
+                    append_once(self.incoming, hub, spoke)
+                    append_once(self.outgoing, spoke, hub)
+                    if region:
+                        append_once(self.cgw_hubs, (region, spoke), hub)
+
+        self.hubs = set(self.incoming)
+        self.spokes = set(self.outgoing)
+
+    def validate(self):
+        """List of violations of the vpcs.yaml rules, empty if there are
+        none."""
+        errors = []
+
+        for name in sorted(self.hubs & self.spokes):
+            errors.append('%s: has both incoming and outgoing connections' %
+                name)
+
+        # A CGW is identified by the spoke's public IP, which AWS allows only
+        # once per region
+        for (region, spoke), hubs in sorted(self.cgw_hubs.items()):
+            if len(hubs) > 1:
+                errors.append('%s: connects to more than one hub in %s: %s' %
+                    (spoke, region, ', '.join(hubs)))
+
+        return errors
+
+    def router_slice(self, name):
+        """The topology as seen by the routers of spoke 'name'."""
+        names = [name] + self.outgoing.get(name, [])
+        return {
+            'vpc': name,
+            'outgoing': self.outgoing.get(name, []),
+            'vpcs': dict((x, self.vpcs[x]) for x in names if x in self.vpcs),
+        }
+
+    def serialize(self, name):
+        return json.dumps(self.router_slice(name), sort_keys=True,
+            separators=(',', ':'))
+
+
+current = None
+
+
+def load():
+    """Topology of configuration/vpcs.yaml, built and validated once for as
+    long as the file doesn't change. Exits if the file breaks the rules."""
+    global current
+
+    vpcs_file = templates.vpcs_file()
+    if current is None or current.source is not vpcs_file:
+        topology = Topology(vpcs_file)
+        errors = topology.validate()
+        if errors:
+            for error in errors:
+                sys.stderr.write('configuration/vpcs.yaml: %s\n' % error)
+            sys.exit(1)
+        current = topology
+
+    return current
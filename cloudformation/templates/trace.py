@@ -0,0 +1,227 @@
+"""Timings of a manage-cfn run, to tell where the minutes go.
+
+A Tracer records manage-cfn's own phases of each stack operation (config,
+render, upload, api, wait) and the stack events it tails. The events are
+turned into a span per resource, from its first *_IN_PROGRESS event to its
+last event, and the critical path through the resources is found along the
+DependsOn, Ref and Fn::GetAtt edges of the template.
+
+report() is JSON serialisable, times are seconds since the start of the run:
+
+    {
+      "start": 1500000000.0,
+      "phases": [{"stack": "ohio-wan", "phase": "render",
+                  "start": 0.2, "end": 1.4}],
+      "stacks": {
+        "ohio-wan": {
+          "resources": {"VpnGateway": {"type": "AWS::EC2::VPNGateway",
+                                       "status": "CREATE_COMPLETE",
+                                       "start": 5.1, "end": 68.3}},
+          "critical_path": ["VpnGateway", "VpnGatewayAttachment"],
+          "critical_path_duration": 140.2
+        }
+      }
+    }
+
+chrome_trace() is the same in the Chrome trace event format, which
+chrome://tracing and https://ui.perfetto.dev open offline.
+"""
+
+import json
+import time
+import calendar
+import threading
+import contextlib
+
+
+def epoch(timestamp):
+    """Seconds since the epoch of an aware (UTC) datetime."""
+    return (calendar.timegm(timestamp.utctimetuple()) +
+        timestamp.microsecond / 1e6)
+
+
+def references(value):
+    """Logical ids 'value' (part of a resource) refers to with Ref or
+    Fn::GetAtt."""
+    found = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Ref' and isinstance(item, basestring):
+                found.add(item)
+            elif key == 'Fn::GetAtt' and isinstance(item, list) and item:
+                found.add(item[0])
+            else:
+                found |= references(item)
+    elif isinstance(value, list):
+        for item in value:
+            found |= references(item)
+    return found
+
+
+def resource_dependencies(template):
+    """logical id -> the logical ids of the resources it depends on."""
+    resources = template.get('Resources', {})
+
+    dependencies = {}
+    for logical_id, resource in resources.items():
+        depends_on = resource.get('DependsOn', [])
+        if isinstance(depends_on, basestring):
+            depends_on = [depends_on]
+        needs = set(depends_on) | references(resource)
+        # Ref's to parameters and pseudo parameters aren't edges
+        dependencies[logical_id] = set(need for need in needs
+            if need in resources and need != logical_id)
+
+    return dependencies
+
+
+def resource_spans(stack_name, events):
+    """logical id -> {'type', 'status', 'start', 'end'} from the stack
+    events, each a {'id', 'type', 'status', 'time'} dictionary."""
+    spans = {}
+    for event in sorted(events, key=lambda event: event['time']):
+        # the stack's own events are its 'wait' phase
+        if event['id'] == stack_name:
+            continue
+        span = spans.setdefault(event['id'], {'type': event['type'],
+            'status': None, 'start': event['time'], 'end': None})
+        span['status'] = event['status']
+        if not event['status'].endswith('_IN_PROGRESS'):
+            span['end'] = event['time']
+
+    # still in progress when the run stopped waiting
+    for span in spans.values():
+        if span['end'] is None:
+            span['end'] = span['start']
+
+    return spans
+
+
+def critical_path(dependencies, results):
+    """Chain of dependencies that determined when the last of 'results'
+    (name -> {'start', 'end'}) finished, first to last."""
+    # Walk back from the one which finished last, through the dependency
+    # which finished last each time
+    finished = [name for name in results if 'end' in results[name]]
+    if not finished:
+        return []
+
+    path = [max(finished, key=lambda name: results[name]['end'])]
+    while True:
+        needs = [need for need in dependencies.get(path[0], [])
+            if need in finished and need not in path]
+        if not needs:
+            return path
+        path.insert(0, max(needs, key=lambda need: results[need]['end']))
+
+
+class Tracer(object):
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+        self.events = {}
+        self.dependencies = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, stack_name, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append({'stack': stack_name, 'phase': name,
+                    'start': start - self.start,
+                    'end': time.time() - self.start})
+
+    def add_dependencies(self, stack_name, dependencies):
+        """Record the resource_dependencies() of the template being
+        deployed, reversed if it is being deleted."""
+        with self.lock:
+            self.dependencies[stack_name] = dependencies
+
+    def add_events(self, stack_name, events):
+        """Record boto3 stack events of 'stack_name'."""
+        with self.lock:
+            self.events.setdefault(stack_name, []).extend({
+                'id': event.logical_resource_id,
+                'type': event.resource_type,
+                'status': event.resource_status,
+                'time': epoch(event.timestamp) - self.start,
+            } for event in events)
+
+    def report(self):
+        stacks = {}
+        for stack_name, events in sorted(self.events.items()):
+            spans = resource_spans(stack_name, events)
+            path = critical_path(self.dependencies.get(stack_name, {}), spans)
+            stacks[stack_name] = {
+                'resources': spans,
+                'critical_path': path,
+                'critical_path_duration': (spans[path[-1]]['end'] -
+                    spans[path[0]]['start']) if path else 0,
+            }
+
+        return {
+            'start': self.start,
+            'phases': sorted(self.phases, key=lambda phase: phase['start']),
+            'stacks': stacks,
+        }
+
+
+def chrome_trace(report):
+    """'report' in the Chrome trace event format: manage-cfn's phases are
+    the first process, a thread per stack, and each stack's resources are
+    a process of their own, a thread per resource."""
+    trace_events = []
+
+    def metadata(kind, name, pid, tid=0):
+        trace_events.append({'name': kind, 'ph': 'M', 'pid': pid, 'tid': tid,
+            'args': {'name': name}})
+
+    def span(name, category, start, end, pid, tid, args=None):
+        trace_events.append({'name': name, 'cat': category, 'ph': 'X',
+            'ts': int(start * 1e6), 'dur': int((end - start) * 1e6),
+            'pid': pid, 'tid': tid, 'args': args or {}})
+
+    metadata('process_name', 'manage-cfn', 1)
+    stack_names = sorted(set([phase['stack'] for phase in report['phases']] +
+        list(report['stacks'])))
+    for tid, stack_name in enumerate(stack_names, 1):
+        metadata('thread_name', stack_name, 1, tid)
+        for phase in report['phases']:
+            if phase['stack'] == stack_name:
+                span(phase['phase'], 'phase', phase['start'], phase['end'],
+                    1, tid)
+
+    for pid, stack_name in enumerate(sorted(report['stacks']), 2):
+        stack = report['stacks'][stack_name]
+        metadata('process_name', stack_name, pid)
+        resources = sorted(stack['resources'].items(),
+            key=lambda item: (item[1]['start'], item[0]))
+        for tid, (logical_id, resource) in enumerate(resources, 1):
+            critical = logical_id in stack['critical_path']
+            metadata('thread_name', logical_id, pid, tid)
+            span(logical_id, 'critical' if critical else 'resource',
+                resource['start'], resource['end'], pid, tid, {
+                    'type': resource['type'],
+                    'status': resource['status'],
+                    'critical': critical,
+                })
+
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def write(report, filename):
+    """Write 'report' to 'filename' and, in the Chrome trace format, to
+    'filename' with a .chrome.json extension. Returns that filename."""
+    chrome_filename = (filename[:-len('.json')] if filename.endswith('.json')
+        else filename) + '.chrome.json'
+
+    for name, content in ((filename, report),
+            (chrome_filename, chrome_trace(report))):
+        with open(name, 'w') as f:
+            json.dump(content, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    return chrome_filename
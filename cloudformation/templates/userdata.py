@@ -0,0 +1,59 @@
+"""Deterministic gzip compressed tar archives for EC2 user data.
+
+The same files always pack to the same bytes (no timestamps, owners or
+ordering differences), so an unchanged configuration renders to an
+unchanged template. The routers run the user data with /bin/bash in
+/usr/local/etc, so the archive is shipped inside a shell script that
+extracts it there (see shell_archive).
+"""
+
+import io
+import base64
+import gzip
+import tarfile
+
+# EC2 limit on the user data, before base64 encoding
+USER_DATA_MAX_SIZE = 16384
+
+
+def pack(files):
+    """gzip compressed tar archive of 'files', a {name: content} dictionary."""
+    buffer = io.BytesIO()
+
+    compressed = gzip.GzipFile(filename='', mode='wb', fileobj=buffer,
+        compresslevel=9, mtime=0)
+    archive = tarfile.open(fileobj=compressed, mode='w',
+        format=tarfile.USTAR_FORMAT)
+    for name in sorted(files):
+        content = files[name]
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mode = 0644
+        info.mtime = 0
+        info.uid = info.gid = 0
+        info.uname = info.gname = 'root'
+        archive.addfile(info, io.BytesIO(content))
+    archive.close()
+    compressed.close()
+
+    return buffer.getvalue()
+
+
+def shell_archive(packed):
+    """A bash script extracting the archive 'packed' into the current
+    directory. The images' ec2-execute-user-data before the tar.gz support
+    only runs the user data with /bin/bash, so until every 'ami_id' is
+    rebuilt from this tree the user data has to stay a script."""
+    encoded = base64.encodestring(packed)
+    return ('#!/bin/bash\n'
+            'base64 -d <<\'END_OF_ARCHIVE\' | tar -xzf - || exit 1\n'
+            '%sEND_OF_ARCHIVE\n'
+            'exit 0\n' % encoded)
+
+
+def size_report(files, user_data):
+    lines = ['%-20s %8d bytes' % (name, len(files[name]))
+        for name in sorted(files)]
+    lines.append('%-20s %8d bytes packed, the limit is %d' %
+        ('total', len(user_data), USER_DATA_MAX_SIZE))
+    return '\n'.join(lines)
@@ -7,13 +7,23 @@ import yaml
 import sys
 import pprint
 
+import templates
+import templates.cidr
 
-def read_yaml_file(filename):
-    if os.path.exists(filename):
-        with open(filename, 'r') as f:
-            return yaml.load(f) or {}
 
-    return {}
+def vpc_subnets(config, vpc_cidr):
+    """The 'subnets' of the stack configuration, or if there are none then
+    subnets derived from the VPC CIDR for the 'zones' of the stack
+    configuration: a public and (unless 'private_subnets' is false) a
+    private subnet in each zone."""
+    if 'subnets' in config and config['subnets']:
+        return config['subnets']
+
+    if 'zones' not in config or not config['zones']:
+        raise ValueError('neither "subnets" nor "zones" configured')
+
+    return templates.cidr.derive_subnets(vpc_cidr, config['zones'],
+        config.get('private_subnets', True))
 
 
 def configure_vpc(config, template):
@@ -22,10 +32,9 @@ def configure_vpc(config, template):
     public_subnets = []
     private_subnets = []
 
-    vpcs_file = read_yaml_file('configuration/vpcs.yaml')
+    vpcs_file = templates.vpcs_file()
     vpcs = vpcs_file['vpcs']
-    connections = vpcs_file['connections']
-    eips = read_yaml_file('configuration/eips.yaml')
+    eips = templates.eips()
 
     if stack not in vpcs:
         sys.stderr.write('%s: not found in vpcs\n' % stack)
@@ -36,6 +45,20 @@ def configure_vpc(config, template):
             '%s: not found in eips; execute "bin/manage-eips"\n' % stack)
         sys.exit(1)
 
+    templates.cidr.check_vpcs_file()
+
+    try:
+        subnets = vpc_subnets(config, vpcs[stack]['cidr'])
+    except ValueError as ex:
+        sys.stderr.write('%s: %s\n' % (stack, ex))
+        sys.exit(1)
+
+    errors = templates.cidr.subnet_errors(vpcs[stack]['cidr'], subnets)
+    if errors:
+        for error in errors:
+            sys.stderr.write('%s: %s\n' % (stack, error))
+        sys.exit(1)
+
     vpc = template.add_resource(ec2.VPC(
         'VPC',
         CidrBlock=vpcs[stack]['cidr'],
@@ -114,7 +137,7 @@ def configure_vpc(config, template):
         NetworkAclId=Ref(network_acl),
     ))
 
-    for subnet_config in config['subnets']:
+    for subnet_config in subnets:
         if subnet_config['public']:
             subnet_list = public_subnets
             subnet_route_table = public_route_table
@@ -1,4 +1,6 @@
-from troposphere import Ref, Tags, GetAtt, Output, Name, cloudformation
+import troposphere
+from troposphere import Ref, Tags, GetAtt, Output, Name, Parameter, \
+    cloudformation
 import troposphere.ec2 as ec2
 import troposphere.iam as iam
 import troposphere.autoscaling as autoscaling
@@ -7,83 +9,461 @@ import troposphere.route53 as route53
 import awacs.aws
 import awacs.sts
 
-import os
 import yaml
 import sys
 import base64
-import itertools
-import subprocess
+import zlib
 import pprint
-import boto.vpc
 import string
-import datetime
+import hashlib
+
+import templates
+import templates.lookups
+import templates.topology
+import templates.userdata
+import templates.cidr
+
+
+# Most resources troposphere allows in a template
+TEMPLATE_MAX_RESOURCES = troposphere.MAX_RESOURCES
+# With 'vpn_shards: auto', hubs with more spokes than this get their
+# per-spoke VPN resources (up to 3 each) in VPN_AUTO_SHARDS nested stacks
+VPN_SHARD_THRESHOLD = 60
+VPN_AUTO_SHARDS = 16
+
+RFC_1918_CIDRS = ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']
+# AWS's default limit on the inbound rules of a security group, see
+# 'sg_max_ingress_rules'
+SG_MAX_INGRESS_RULES = 60
+# AWS's limit on the entries of a managed prefix list
+PREFIX_LIST_MAX_ENTRIES = 1000
+
+# 'ipsec' proposal values both AWS VPN tunnels and VyOS accept, by VyOS name
+IPSEC_ENCRYPTIONS = ['aes128', 'aes256', 'aes128gcm128', 'aes256gcm128']
+IPSEC_HASHES = ['sha1', 'sha256', 'sha384', 'sha512']
+IPSEC_DH_GROUPS = [2, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24]
+# Most equal cost BGP paths VyOS installs for a prefix
+BGP_MAXIMUM_PATHS = 255
+# 'telemetry' sinks tunnel-telemetry knows, 'file' and 'statsd' take an
+# argument after a colon
+TELEMETRY_SINKS = ['cloudwatch', 'file', 'statsd']
 
 
 def print_err(message):
     sys.stderr.write(message)
 
 
-def read_yaml_file(filename):
-    if os.path.exists(filename):
-        with open(filename, 'r') as f:
-            return yaml.load(f) or {}
-
-    return {}
+def ipsec_errors(ipsec):
+    """Problems with the 'ipsec' configuration, checked while rendering
+    since the routers can only log them."""
+    errors = []
+
+    maximum_paths = ipsec.get('maximum_paths')
+    if (not isinstance(maximum_paths, int) or
+            not 1 <= maximum_paths <= BGP_MAXIMUM_PATHS):
+        errors.append('maximum_paths: must be between 1 and %d' %
+            BGP_MAXIMUM_PATHS)
+
+    for phase in ('ike_proposals', 'esp_proposals'):
+        proposals = ipsec.get(phase)
+        if not proposals or not isinstance(proposals, list):
+            errors.append('%s: must list at least one proposal' % phase)
+            continue
+        for index, proposal in enumerate(proposals, 1):
+            proposal = proposal or {}
+            if proposal.get('encryption') not in IPSEC_ENCRYPTIONS:
+                errors.append('%s %d: encryption must be one of %s' %
+                    (phase, index, ', '.join(IPSEC_ENCRYPTIONS)))
+            if proposal.get('hash') not in IPSEC_HASHES:
+                errors.append('%s %d: hash must be one of %s' %
+                    (phase, index, ', '.join(IPSEC_HASHES)))
+            if (phase == 'ike_proposals' and
+                    proposal.get('dh_group') not in IPSEC_DH_GROUPS):
+                errors.append('%s %d: dh_group must be one of %s' %
+                    (phase, index, ', '.join(str(x) for x in IPSEC_DH_GROUPS)))
+
+    return errors
+
+
+def telemetry_errors(telemetry):
+    """Problems with the 'telemetry' configuration."""
+    errors = []
+
+    sink = str(telemetry.get('sink'))
+    if sink.split(':')[0] not in TELEMETRY_SINKS:
+        errors.append('sink: must be one of %s' % ', '.join(TELEMETRY_SINKS))
+    elif sink.startswith('statsd') and len(sink.split(':')) != 3:
+        errors.append('sink: must be statsd:HOST:PORT')
+    elif sink.startswith('file') and not sink[len('file:'):]:
+        errors.append('sink: must be file:PATH')
+
+    for name in ('interval', 'flush'):
+        if (not isinstance(telemetry.get(name), (int, float)) or
+                telemetry[name] <= 0):
+            errors.append('%s: must be a positive number of seconds' % name)
+    if (not isinstance(telemetry.get('ping_count'), int) or
+            telemetry['ping_count'] < 0):
+        errors.append('ping_count: must be 0 or more')
+
+    return errors
 
 
 # To extract UserData from the template:
 # jq -r .Resources.Ec2NatLaunchConfiguration.Properties.UserData < json | base64 -d
-def build_user_data(stack):
-    user_data = '#!/bin/bash\n' + subprocess.check_output(
-        'cd configuration && '
-        'ln -s stacks/%(stack)s/config.yaml stack-config.yaml && '
-        'shar vpcs.yaml eips.yaml stack-config.yaml && '
-        'rm -f stack-config.yaml' % locals(), shell=True)
+def build_user_data(config, topology):
+    """The files the routers read from /usr/local/etc, packed by
+    templates.userdata into a script extracting them. Only the slice of the
+    configuration this VPC's routers need is shipped: their own EIP and
+    their 'topology' (see Topology.router_slice), rather than all of
+    vpcs.yaml and eips.yaml."""
+    stack = config['stack']
+    vpc_name = config['vpc']
+
+    # ha-nat has to agree with the template on 'ha_monitor', which may
+    # come from the template configuration rather than the stack's, and
+    # configure-ipsec-client and tunnel-telemetry need the merged 'ipsec'
+    # and 'telemetry' settings
+    stack_config = templates.read_yaml_file(
+        'configuration/stacks/%s/config.yaml' % stack)
+    stack_config['ha_monitor'] = bool(config['ha_monitor'])
+
+    errors = ipsec_errors(config['ipsec'])
+    if errors:
+        for error in errors:
+            print_err('%s: ipsec: %s\n' % (stack, error))
+        sys.exit(1)
+    stack_config['ipsec'] = config['ipsec']
+
+    errors = telemetry_errors(config['telemetry'])
+    if errors:
+        for error in errors:
+            print_err('%s: telemetry: %s\n' % (stack, error))
+        sys.exit(1)
+    stack_config['telemetry'] = config['telemetry']
+
+    files = {
+        'stack-config.yaml': yaml.safe_dump(stack_config,
+                                            default_flow_style=False),
+        'eips.yaml': yaml.safe_dump({vpc_name: templates.eips()[vpc_name]},
+                                    default_flow_style=False),
+        # The routers' view of the topology, read by configure-ipsec-client
+        'topology.json': topology + '\n',
+    }
+
+    user_data = templates.userdata.shell_archive(
+        templates.userdata.pack(files))
+    if len(user_data) > templates.userdata.USER_DATA_MAX_SIZE:
+        print_err('%(stack)s: the user data is too large:\n%(report)s\n' % {
+            'stack': stack,
+            'report': templates.userdata.size_report(files, user_data),
+        })
+        sys.exit(1)
+
     return base64.b64encode(user_data)
 
 
-def get_route_table_ids(vpc_id, region):
-    conn = boto.vpc.connect_to_region(region)
+def router_version(config, user_data, topology):
+    """Hash of everything the routers are built from, so that the routers
+    are only replaced when one of them changes. 'roll' (set by manage-cfn
+    --roll, or kept from the deployed stack) is appended to force a
+    replacement of identical routers."""
+    region = config['region']
 
-    # extract route id's, filter out None results
-    route_table_ids = [route_table_id for route_table_id in
-                       map(lambda x: x.id,
-                           conn.get_all_route_tables(filters={'vpc_id': vpc_id})) if
-                       route_table_id]
+    digest = hashlib.sha256()
+    for value in (user_data, config['nat']['ami_id'][region],
+                  config['nat']['instance_type'], topology):
+        digest.update(str(value) + '\0')
+    version = digest.hexdigest()[:16]
 
-    return route_table_ids
+    if config.get('roll'):
+        version += '-' + config['roll']
 
+    return version
 
-def get_vpc_id(vpc_name, region):
-    conn = boto.vpc.connect_to_region(region)
 
-    vpcs = (conn.get_all_vpcs(filters={'tag:stack-name': vpc_name}) or
-            conn.get_all_vpcs(filters={'tag:aws:cloudformation:stack-name': vpc_name}))
+def compile_ingress_rules(config, template, sources):
+    """Security group ingress rules allowing 'sources', a list of (name,
+    protocol, port, CIDRs).
 
-    if vpcs:
-        if len(vpcs) == 1:
-            return vpcs[0].id
-        else:
-            print_err('%(vpc_name)s: found multiple matching VPC\'s: '
-                      '%(vpcs)s\n' % locals())
+    The CIDRs of each protocol and port are collapsed into the fewest
+    covering the same addresses, so overlapping and duplicate sources cost
+    nothing and neighbouring /32's merge. With 'nat: ingress_prefix_list'
+    the all-traffic CIDRs go into a managed prefix list (if troposphere
+    supports them) referenced by a single rule. Exits with a report if the
+    rules don't fit in the security group's limit."""
+    stack = config['stack']
+    max_rules = int(config['nat'].get('sg_max_ingress_rules') or
+                    SG_MAX_INGRESS_RULES)
+
+    grouped = {}
+    for name, protocol, port, cidrs in sources:
+        grouped.setdefault((protocol, str(port)), []).extend(cidrs)
+
+    collapsed = {}
+    for key, cidrs in grouped.items():
+        try:
+            collapsed[key] = templates.cidr.collapse(cidrs)
+        except ValueError as ex:
+            print_err('%s: router security group: %s\n' % (stack, ex))
             sys.exit(1)
-    else:
-        print_err('%(vpc_name)s: VPC not found\n' % locals())
+
+    prefix_list = None
+    if config['nat'].get('ingress_prefix_list') and collapsed.get(('-1', '-1')):
+        if hasattr(ec2, 'PrefixList'):
+            entries = collapsed.pop(('-1', '-1'))
+            if len(entries) > PREFIX_LIST_MAX_ENTRIES:
+                print_err('%s: the router prefix list needs %d entries, more '
+                          'than the %d allowed\n' % (
+                              stack, len(entries), PREFIX_LIST_MAX_ENTRIES))
+                sys.exit(1)
+            prefix_list = template.add_resource(ec2.PrefixList(
+                'NatPrefixList',
+                PrefixListName='%s-router-sources' % stack,
+                AddressFamily='IPv4',
+                MaxEntries=len(entries),
+                Entries=[ec2.Entry(Cidr=cidr) for cidr in entries],
+            ))
+        else:
+            print_err('%s: this troposphere has no managed prefix lists, '
+                      'ignoring \'ingress_prefix_list\'\n' % stack)
+
+    rules = []
+    if prefix_list:
+        rules.append(ec2.SecurityGroupRule(
+            SourcePrefixListId=Ref(prefix_list),
+            IpProtocol='-1',
+            FromPort='-1',
+            ToPort='-1',
+        ))
+    for (protocol, port), cidrs in sorted(collapsed.items()):
+        rules.extend(ec2.SecurityGroupRule(
+            CidrIp=cidr,
+            IpProtocol=protocol,
+            FromPort=port,
+            ToPort=port,
+        ) for cidr in cidrs)
+
+    # A prefix list counts as its maximum number of entries
+    count = sum(len(cidrs) for cidrs in collapsed.values()) + (
+        prefix_list.MaxEntries if prefix_list else 0)
+    if count > max_rules:
+        report = ['%s: the router security group needs %d ingress rules, '
+                  'more than the %d allowed (nat: sg_max_ingress_rules):' %
+                  (stack, count, max_rules)]
+        for name, protocol, port, cidrs in sources:
+            report.append('  %-25s %5d CIDRs' % (name, len(cidrs)))
+        for (protocol, port), cidrs in sorted(grouped.items()):
+            report.append('  protocol %s port %s: %d CIDRs collapse to %d '
+                          'rules' % (protocol, port, len(cidrs),
+                                     len(templates.cidr.collapse(cidrs))))
+        print_err('\n'.join(report) + '\n')
         sys.exit(1)
 
+    return rules
+
+
+def get_route_table_ids(vpc_id, region):
+    filters = {'vpc_id': vpc_id}
+
+    def resolve(conn):
+        # extract route id's, filter out None results
+        return [route_table_id for route_table_id in
+                map(lambda x: x.id,
+                    conn.get_all_route_tables(filters=filters)) if
+                route_table_id]
+
+    return templates.lookups.lookup(region, 'route_table_ids', vpc_id,
+                                    resolve, filters)
+
+
+def get_vpc_id(vpc_name, region):
+    def resolve(conn):
+        vpcs = (conn.get_all_vpcs(filters={'tag:stack-name': vpc_name}) or
+                conn.get_all_vpcs(filters={'tag:aws:cloudformation:stack-name': vpc_name}))
+
+        if vpcs:
+            if len(vpcs) == 1:
+                return vpcs[0].id
+            else:
+                print_err('%(vpc_name)s: found multiple matching VPC\'s: '
+                          '%(vpcs)s\n' % locals())
+                sys.exit(1)
+        else:
+            print_err('%(vpc_name)s: VPC not found\n' % locals())
+            sys.exit(1)
+
+    return templates.lookups.lookup(region, 'vpc_id', vpc_name, resolve)
+
 
 def get_public_subnet_ids(vpc_id, region):
-    conn = boto.vpc.connect_to_region(region)
+    filters = {'vpc_id': vpc_id, 'tag:IsPublic': 'true'}
 
-    public_subnets = map(lambda x: x.id,
-                         conn.get_all_subnets(filters={'vpc_id': vpc_id, 'tag:IsPublic': 'true'}))
+    def resolve(conn):
+        public_subnets = map(lambda x: x.id,
+                             conn.get_all_subnets(filters=filters))
 
-    if not public_subnets:
-        print_err('%(vpc_id)s: failed to find any subnets tagged IsPublic:true' %
-                  locals())
-        sys.exit(1)
+        if not public_subnets:
+            print_err('%(vpc_id)s: failed to find any subnets tagged IsPublic:true' %
+                      locals())
+            sys.exit(1)
+
+        return public_subnets
+
+    return templates.lookups.lookup(region, 'public_subnet_ids', vpc_id,
+                                    resolve, filters)
+
+
+def spoke_shard(spoke, shards):
+    # crc32 is stable across runs and Python versions, unlike hash(), so
+    # a spoke stays in its shard for as long as the number of shards is
+    # the same
+    return (zlib.crc32(spoke.encode('utf-8')) & 0xffffffff) % shards
+
+
+def vpn_shard_count(config, spokes):
+    """Number of nested stacks for the hub's per-spoke VPN resources, 0 to
+    keep them in the hub's own template. 'vpn_shards: auto' shards only
+    hubs with more than VPN_SHARD_THRESHOLD spokes."""
+    shards = config.get('vpn_shards', 0)
+    if shards == 'auto':
+        return VPN_AUTO_SHARDS if spokes > VPN_SHARD_THRESHOLD else 0
+    return int(shards or 0)
 
-    return public_subnets
+
+def check_vpn_shards(config, shards):
+    """Refuse to move a deployed hub's spokes between shards (or between
+    its own template and the shards): CloudFormation deletes each moved
+    spoke's CGW and VPN connection and creates new ones, with new tunnel
+    addresses and pre-shared keys, and the spoke's tunnels are down until
+    its routers are replaced. AWS also refuses a second CGW with the same
+    IP in a region, so the new ones can fail to create while the old ones
+    exist. manage-cfn sets 'deployed_vpn_shards' to the deployed stack's
+    number of shards (None if it can't tell), and 'reshard' with
+    --reshard."""
+    if 'deployed_vpn_shards' not in config or config.get('reshard'):
+        return
+
+    deployed = config['deployed_vpn_shards']
+    if deployed == shards:
+        return
+
+    stack = config['stack']
+    print_err('%(stack)s: the deployed stack has %(deployed)s VPN shards, '
+              'this render has %(shards)d: most spokes\' VPN connections '
+              'would be re-created, with new tunnel addresses and keys, and '
+              'be down until their routers are replaced. Set \'vpn_shards\' '
+              'back, or pass --reshard to do it anyway\n' % {
+                  'stack': stack,
+                  'deployed': ('an unknown number of' if deployed is None
+                               else deployed),
+                  'shards': shards,
+              })
+    sys.exit(1)
+
+
+def add_spoke_vpn(config, template, connection_from, vpn_gateway_id):
+    """Add the hub's CGW and VPN connection (and static route) for
+    'connection_from' to 'template'. Returns the CGW."""
+    stack = config['stack']
+    vpc_name = config['vpc']
+    vpcs = templates.vpcs_file()['vpcs']
+    eips = templates.eips()
+
+    alphanumeric_id = ''.join([y.title()
+                               for y in connection_from.split('-')])
+    customer_gateway = template.add_resource(ec2.CustomerGateway(
+        alphanumeric_id + 'CGW',
+        BgpAsn=vpcs[connection_from]['bgp_asn'],
+        IpAddress=eips[connection_from]['public_ip'],
+        Type='ipsec.1',
+        Tags=Tags(
+            Name='%(connection_from)s to %(stack)s' % locals(),
+            VPC=vpc_name,
+        ),
+    ))
+
+    vpn_connection = template.add_resource(ec2.VPNConnection(
+        alphanumeric_id + 'VPNConnection',
+        # We want this to always be 'False', for BGP
+        StaticRoutesOnly=config['static_routing'],
+        Type='ipsec.1',
+        VpnGatewayId=vpn_gateway_id,
+        CustomerGatewayId=Ref(customer_gateway),
+        Tags=Tags(
+            Name='%s CGW: IP %s' % (
+                connection_from,
+                eips[connection_from]['public_ip']),
+            # The Tag 'RemoteVPC' is queried by
+            # configuration process on the remote VPC's NAT
+            # instance to identify the Virtual Connection they
+            # should connect to.
+            # It refers to the VPC stack name, not the WAN stack name
+            RemoteVPC=connection_from,
+            RemoteIp=eips[connection_from]['public_ip'],
+            VPC=vpc_name,
+        ),
+    ))
+
+    # Add static routes to the subnets behind each incoming VPN connection
+    # NOTE: Can't be used when StaticRoutesOnly is False (which is required
+    # when using BGP)
+    if config['static_routing']:
+        vpn_connection_static_route = template.add_resource(ec2.VPNConnectionRoute(
+            alphanumeric_id + 'StaticRoute',
+            VpnConnectionId=Ref(vpn_connection),
+            DestinationCidrBlock=vpcs[connection_from]['cidr'],
+        ))
+
+    return customer_gateway
+
+
+def add_vpn_shards(config, template, incoming_connections, shards,
+                   vpn_gateway):
+    """Put the per-spoke VPN resources in 'shards' nested stacks, each
+    spoke in the one spoke_shard() picks. A change to a spoke only updates
+    its shard, and CloudFormation works on the shards in parallel."""
+    stack = config['stack']
+    spoke_resources = 3 if config['static_routing'] else 2
+
+    shard_spokes = [[] for shard in range(shards)]
+    for connection_from in incoming_connections:
+        shard_spokes[spoke_shard(connection_from, shards)].append(
+            connection_from)
+
+    for shard, spokes in enumerate(shard_spokes):
+        # empty shards only appear once a spoke is assigned to them
+        if not spokes:
+            continue
+
+        if len(spokes) * spoke_resources > TEMPLATE_MAX_RESOURCES:
+            print_err('%s: VPN shard %d needs %d resources for its %d '
+                      'spokes, more than the %d of a template; raise '
+                      '\'vpn_shards\' (which moves spokes between '
+                      'shards, see --reshard)\n' % (stack, shard,
+                                      len(spokes) * spoke_resources,
+                                      len(spokes), TEMPLATE_MAX_RESOURCES))
+            sys.exit(1)
+
+        shard_template = troposphere.Template()
+        shard_template.add_version('2010-09-09')
+        shard_template.add_description('%s VPN connections, shard %d of %d'
+                                       % (stack, shard + 1, shards))
+        vpn_gateway_id = shard_template.add_parameter(Parameter(
+            'VpnGateway',
+            Type='String',
+            Description='The hub\'s VPN gateway',
+        ))
+        for connection_from in spokes:
+            add_spoke_vpn(config, shard_template, connection_from,
+                          Ref(vpn_gateway_id))
+
+        body = shard_template.to_json(sort_keys=True, indent=2,
+                                      separators=(',', ': '))
+        template.add_resource(cloudformation.Stack(
+            'VpnShard%d' % shard,
+            TemplateURL=templates.nested_template(config, body),
+            Parameters={'VpnGateway': Ref(vpn_gateway)},
+        ))
 
 
 def setup_vpn(config, template):
@@ -99,11 +479,11 @@ def setup_vpn(config, template):
         print_err('%(stack)s: missing region\n' % locals())
         sys.exit(1)
 
-    vpcs_file = read_yaml_file('configuration/vpcs.yaml')
+    vpcs_file = templates.vpcs_file()
     vpcs = vpcs_file['vpcs']
-    connections = vpcs_file['connections']
+    topology = templates.topology.load()
 
-    eips = read_yaml_file('configuration/eips.yaml')
+    eips = templates.eips()
 
     # NOTE: we look for the base VPC in 'vpcs' and in eips
     # EIP's are allocated per VPC, since it's easier to manage
@@ -119,17 +499,8 @@ def setup_vpn(config, template):
 
     vpc_id = get_vpc_id(vpc_name, region)
 
-    incoming_connections = map(
-        lambda x: x.keys()[0] if isinstance(x, dict) else x,
-        list(itertools.chain.from_iterable(
-            x['from'] for x in connections.values()
-            if 'to' in x and vpc_name in x['to'])))
-
-    outgoing_connections = map(
-        lambda x: x.keys()[0] if isinstance(x, dict) else x,
-        list(itertools.chain.from_iterable(
-            x['to'] for x in connections.values()
-            if 'from' in x and vpc_name in x['from'])))
+    incoming_connections = topology.incoming.get(vpc_name, [])
+    outgoing_connections = topology.outgoing.get(vpc_name, [])
 
     # if we expect incoming VPN connections then setup a VPN gateway
     if incoming_connections:
@@ -155,7 +526,7 @@ def setup_vpn(config, template):
             DependsOn=Name(vpn_gateway_attachment),
         ))
 
-        for index, connection_from in enumerate(incoming_connections, 1):
+        for connection_from in incoming_connections:
             if connection_from not in vpcs:
                 print_err(
                     '%(stack)s: vpn from "%(connection_from)s" not found in vpcs\n' % locals())
@@ -166,52 +537,18 @@ def setup_vpn(config, template):
                     '%(stack)s: vpn from "%(connection_from)s" not found in eips\n' % locals())
                 sys.exit(1)
 
-            alphanumeric_id = ''.join([y.title()
-                                       for y in connection_from.split('-')])
-            customer_gateway = template.add_resource(ec2.CustomerGateway(
-                alphanumeric_id + 'CGW',
-                BgpAsn=vpcs[connection_from]['bgp_asn'],
-                IpAddress=eips[connection_from]['public_ip'],
-                Type='ipsec.1',
-                Tags=Tags(
-                    Name='%(connection_from)s to %(stack)s' % locals(),
-                    VPC=vpc_name,
-                ),
-            ))
-
-            vpn_connection = template.add_resource(ec2.VPNConnection(
-                alphanumeric_id + 'VPNConnection',
-                # We want this to always be 'False', for BGP
-                StaticRoutesOnly=config['static_routing'],
-                Type='ipsec.1',
-                VpnGatewayId=Ref(vpn_gateway),
-                CustomerGatewayId=Ref(customer_gateway),
-                Tags=Tags(
-                    Name='%s CGW: IP %s' % (
-                        connection_from,
-                        eips[connection_from]['public_ip']),
-                    # The Tag 'RemoteVPC' is queried by
-                    # configuration process on the remote VPC's NAT
-                    # instance to identify the Virtual Connection they
-                    # should connect to.
-                    # It refers to the VPC stack name, not the WAN stack name
-                    RemoteVPC=connection_from,
-                    RemoteIp=eips[connection_from]['public_ip'],
-                    VPC=vpc_name,
-                ),
-            ))
-
-            # Add static routes to the subnets behind each incoming VPN connection
-            # NOTE: Can't be used when StaticRoutesOnly is False (which is required
-            # when using BGP)
-            if config['static_routing']:
-                vpn_connection_static_route = template.add_resource(ec2.VPNConnectionRoute(
-                    '%(connection_from)s Static Route' % locals(),
-                    VpnConnectionId=Ref(vpn_connection),
-                    DestinationCidrBlock=vpcs[connection_from]['cidr'],
-                ))
-
-            customer_gateways.append(customer_gateway)
+        shards = vpn_shard_count(config, len(incoming_connections))
+        check_vpn_shards(config, shards)
+        if not shards:
+            for connection_from in incoming_connections:
+                customer_gateways.append(add_spoke_vpn(
+                    config, template, connection_from, Ref(vpn_gateway)))
+        else:
+            add_vpn_shards(config, template, incoming_connections, shards,
+                           vpn_gateway)
+            # read back by manage-cfn (deployed_vpn_shards) to refuse
+            # changing the layout of a deployed hub by accident
+            template.add_metadata({'VpnShards': shards})
 
     else:
         vpn_gateway = None
@@ -222,6 +559,19 @@ def setup_vpn(config, template):
                       locals())
             sys.exit(1)
 
+        ingress_rules = compile_ingress_rules(config, template, [
+            # Allow all traffic from internal networks
+            ('internal networks', '-1', '-1', RFC_1918_CIDRS),
+            # Allow all traffic from all other locations on our WAN
+            ('WAN locations', '-1', '-1',
+             [eips[eip]['public_ip'] + '/32' for eip in sorted(eips)]),
+            # Optional extra traffic sources
+            ('extra_ingress_sources', '-1', '-1',
+             config['nat']['extra_ingress_sources'] or []),
+            ('OpenVPN', 'udp', '1194',
+             ['0.0.0.0/0'] if config.get('openvpn_server') else []),
+        ])
+
         nat_sg = template.add_resource(ec2.SecurityGroup(
             'NatSg',
             VpcId=vpc_id,
@@ -233,46 +583,13 @@ def setup_vpn(config, template):
                     FromPort='-1',
                     ToPort='-1',
                 )],
-            SecurityGroupIngress=  # Allow all traffic from internal networks
-            map(lambda cidr:
-                ec2.SecurityGroupRule(
-                    CidrIp=cidr,
-                    IpProtocol='-1',
-                    FromPort='-1',
-                    ToPort='-1'),
-                ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']
-                ) +
-            # Allow all traffic from all other locations on our WAN
-            map(lambda eip:
-                ec2.SecurityGroupRule(
-                    CidrIp=eips[eip]['public_ip'] + '/32',
-                    IpProtocol='-1',
-                    FromPort='-1',
-                    ToPort='-1'),
-                eips.keys()
-                ) +
-            # Optional extra traffic sources
-            map(lambda cidr:
-                ec2.SecurityGroupRule(
-                    CidrIp=cidr,
-                    IpProtocol='-1',
-                    FromPort='-1',
-                    ToPort='-1'),
-                config['nat']['extra_ingress_sources'] or {}
-                ),
+            SecurityGroupIngress=ingress_rules,
             Tags=Tags(
                 Name='%(stack)s router' % locals(),
             ),
         ))
 
         if 'openvpn_server' in config and config['openvpn_server']:
-            nat_sg.SecurityGroupIngress.append(ec2.SecurityGroupRule(
-                CidrIp='0.0.0.0/0',
-                IpProtocol='udp',
-                FromPort='1194',
-                ToPort='1194',
-            ))
-
             if 'external_tld' in config:
                 template.add_resource(route53.RecordSetType(
                     'OpenVpnDnsRecord',
@@ -333,6 +650,9 @@ def setup_vpn(config, template):
                 GroupId=Ref(nat_sg),
             ))
 
+        router_topology = topology.serialize(vpc_name)
+        user_data = build_user_data(config, router_topology)
+
         launch_configuration = template.add_resource(autoscaling.LaunchConfiguration(
             'Ec2NatLaunchConfiguration',
             AssociatePublicIpAddress=True,
@@ -341,14 +661,15 @@ def setup_vpn(config, template):
             ImageId=config['nat']['ami_id'][region],
             KeyName=config['nat']['key_name'],
             InstanceType=config['nat']['instance_type'],
-            UserData=build_user_data(stack),
+            UserData=user_data,
         ))
 
         AutoScalingGroup = template.add_resource(autoscaling.AutoScalingGroup(
             'AutoScalingGroup',
             VPCZoneIdentifier=get_public_subnet_ids(vpc_id, region),
             TerminationPolicies=['ClosestToNextInstanceHour'],
-            MinSize=1,
+            # Two routers run active/standby with 'ha_monitor', see ha-nat
+            MinSize=2 if config['ha_monitor'] else 1,
             MaxSize=2,
             #####
             # TODO: Have to find a way for VyOS to send the signal without
@@ -376,10 +697,10 @@ def setup_vpn(config, template):
             Tags=[
                 autoscaling.Tag('Name', stack + ' router', True),
                 autoscaling.Tag('VPC', vpc_name, True),
-                # Just have to be unique for this provisioning run, could
-                # be any unique string
+                # Changing it replaces the routers, see router_version()
                 autoscaling.Tag('Version',
-                                datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f'),
+                                router_version(config, user_data,
+                                               router_topology),
                                 True),
             ],
         ))
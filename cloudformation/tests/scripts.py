@@ -0,0 +1,29 @@
+# Loads the scripts in bin/, which have no .py extension, as modules. The
+# tests are run from cloudformation/, like the scripts themselves.
+
+import os
+import imp
+import sys
+import logging
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'bin')
+
+
+def script_path(name):
+    return os.path.join(BIN_DIR, name)
+
+
+def load_script(name):
+    # imp would leave a compiled '<name>c' next to the script
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        module = imp.load_source(name.replace('-', '_'), script_path(name))
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+    # set up by the scripts' main()
+    if getattr(module, 'logger', False) is None:
+        module.logger = logging.getLogger(name)
+    return module
@@ -0,0 +1,179 @@
+# templates.cidr, checked on examples and against brute force on random
+# blocks of a small address space.
+
+import random
+import unittest
+
+import templates.cidr as cidr
+
+
+def addresses(cidrs):
+    "set of the addresses of 'cidrs', for blocks of a few hundred addresses"
+    result = set()
+    for first, last in [cidr.block(x) for x in cidrs]:
+        result.update(range(first, last + 1))
+    return result
+
+
+def random_cidrs(rng, count):
+    "'count' random blocks of 10.0.0.0/22, /24 to /30"
+    result = []
+    for index in range(count):
+        prefix_length = rng.randint(24, 30)
+        first = cidr.parse('10.0.0.0/22')[0] + rng.randrange(
+            0, 1024, cidr.size(prefix_length))
+        result.append(cidr.format_cidr(first, prefix_length))
+    return result
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(cidr.parse('10.1.0.0/16'),
+                         ((10 << 24) | (1 << 16), 16))
+        self.assertEqual(cidr.block('192.168.1.0/30'),
+                         (cidr.parse('192.168.1.0/32')[0],
+                          cidr.parse('192.168.1.3/32')[0]))
+
+    def test_invalid(self):
+        for value in ('10.0.0.0', '10.0.0/8', '10.0.0.256/32', '10.0.0.0/33',
+                      'ten/8', None):
+            self.assertRaises(ValueError, cidr.parse, value)
+
+    def test_host_bits(self):
+        self.assertRaises(ValueError, cidr.parse, '10.0.0.1/24')
+
+
+class OverlapsTest(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(cidr.overlaps([('10.0.0.0/16', 'a'),
+                                        ('10.1.0.0/16', 'b')]), [])
+        self.assertEqual(cidr.overlaps([('10.1.0.0/16', 'b'),
+                                        ('10.0.0.0/8', 'a'),
+                                        ('192.168.0.0/16', 'c')]),
+                         [('a', 'b')])
+        # adjacent isn't overlapping
+        self.assertEqual(cidr.overlaps([('10.0.0.0/25', 'a'),
+                                        ('10.0.0.128/25', 'b')]), [])
+        self.assertEqual(cidr.overlaps([('10.0.0.0/24', 'a'),
+                                        ('10.0.0.0/24', 'b')]), [('a', 'b')])
+
+    def test_every_overlapping_block_reported(self):
+        rng = random.Random(1)
+        for round in range(200):
+            cidrs = random_cidrs(rng, 6)
+            labelled = [(x, index) for index, x in enumerate(cidrs)]
+            expected = set()
+            for i, a in enumerate(cidrs):
+                for j, b in enumerate(cidrs):
+                    if i != j and addresses([a]) & addresses([b]):
+                        expected.add(i)
+            reported = set()
+            for a, b in cidr.overlaps(labelled):
+                self.assertTrue(addresses([cidrs[a]]) & addresses([cidrs[b]]))
+                reported.update([a, b])
+            self.assertEqual(reported, expected, cidrs)
+
+
+class CollapseTest(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(cidr.collapse(['10.0.0.0/25', '10.0.0.128/25']),
+                         ['10.0.0.0/24'])
+        self.assertEqual(cidr.collapse(['10.0.0.0/24', '10.0.0.5/32',
+                                        '10.0.0.0/24']), ['10.0.0.0/24'])
+        # adjacent but not aligned: no single covering block
+        self.assertEqual(cidr.collapse(['10.0.1.0/24', '10.0.2.0/24']),
+                         ['10.0.1.0/24', '10.0.2.0/24'])
+        self.assertEqual(cidr.collapse(['1.2.3.4/32', '1.2.3.5/32',
+                                        '1.2.3.6/32']),
+                         ['1.2.3.4/31', '1.2.3.6/32'])
+        self.assertEqual(cidr.collapse([]), [])
+
+    def test_same_addresses_fewest_blocks(self):
+        rng = random.Random(2)
+        for round in range(200):
+            cidrs = random_cidrs(rng, rng.randint(1, 8))
+            collapsed = cidr.collapse(cidrs)
+            self.assertEqual(addresses(collapsed), addresses(cidrs), cidrs)
+            # a second collapse has nothing left to merge
+            self.assertEqual(cidr.collapse(collapsed), collapsed)
+            self.assertEqual(cidr.overlaps([(x, x) for x in collapsed]), [])
+
+
+class AllocateTest(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(cidr.allocate('10.0.0.0/8', 16, []), '10.0.0.0/16')
+        self.assertEqual(cidr.allocate('10.0.0.0/8', 16,
+                                       ['10.0.0.0/16', '10.1.0.0/17']),
+                         '10.2.0.0/16')
+        # a gap between used blocks, and used blocks outside the pool
+        self.assertEqual(cidr.allocate('10.0.0.0/8', 16,
+                                       ['10.0.0.0/16', '10.2.0.0/16',
+                                        '172.16.0.0/12']), '10.1.0.0/16')
+        # a larger block covering the start of the pool
+        self.assertEqual(cidr.allocate('10.0.0.0/16', 24, ['10.0.0.0/8']),
+                         None)
+
+    def test_full(self):
+        self.assertEqual(cidr.allocate('10.0.0.0/23', 24,
+                                       ['10.0.0.0/24', '10.0.1.0/24']), None)
+
+    def test_too_large(self):
+        self.assertRaises(ValueError, cidr.allocate, '10.0.0.0/16', 8, [])
+
+    def test_first_free_block(self):
+        rng = random.Random(3)
+        for round in range(200):
+            used = random_cidrs(rng, rng.randint(0, 8))
+            prefix_length = rng.randint(24, 28)
+            taken = addresses(used)
+            expected = None
+            for first in range(cidr.parse('10.0.0.0/22')[0],
+                               cidr.block('10.0.0.0/22')[1] + 1,
+                               cidr.size(prefix_length)):
+                candidate = cidr.format_cidr(first, prefix_length)
+                if not addresses([candidate]) & taken:
+                    expected = candidate
+                    break
+            self.assertEqual(cidr.allocate('10.0.0.0/22', prefix_length,
+                                           used), expected, used)
+
+
+class SubnetsTest(unittest.TestCase):
+    def test_derive(self):
+        subnets = cidr.derive_subnets('10.0.0.0/16', ['a', 'b', 'c'])
+        self.assertEqual([(x['cidr'], x['zone'], x['public'])
+                          for x in subnets], [
+            ('10.0.0.0/19', 'a', True),
+            ('10.0.32.0/19', 'b', True),
+            ('10.0.64.0/19', 'c', True),
+            ('10.0.96.0/19', 'a', False),
+            ('10.0.128.0/19', 'b', False),
+            ('10.0.160.0/19', 'c', False),
+        ])
+        self.assertEqual(cidr.subnet_errors('10.0.0.0/16', subnets), [])
+
+    def test_subnet_errors(self):
+        errors = cidr.subnet_errors('10.0.0.0/16', [
+            {'cidr': '10.0.0.0/24', 'zone': 'a'},
+            {'cidr': '10.0.0.128/25', 'zone': 'b'},
+            {'cidr': '10.1.0.0/24', 'zone': 'a'},
+            {'cidr': '10.0.9.0/29', 'zone': 'a'},
+        ])
+        self.assertEqual(errors, [
+            'subnet 10.1.0.0/24 (a): not within the VPC\'s 10.0.0.0/16',
+            'subnet 10.0.9.0/29 (a): prefix length must be between /16 and '
+            '/28',
+            'subnet 10.0.0.128/25 (b) overlaps 10.0.0.0/24 (a)',
+        ])
+
+    def test_vpc_errors(self):
+        self.assertEqual(cidr.vpc_errors({
+            'ohio': {'cidr': '10.0.0.0/16'},
+            'oregon': {'cidr': '10.0.128.0/17'},
+            'virginia': {},
+        }), ['virginia: no cidr',
+             'oregon (10.0.128.0/17) overlaps ohio (10.0.0.0/16)'])
+
+
+if __name__ == '__main__':
+    unittest.main()
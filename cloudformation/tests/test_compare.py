@@ -0,0 +1,114 @@
+# Comparing two templates with templates.compare.
+
+import json
+import unittest
+
+import templates.compare as compare
+
+
+def template(resources, **sections):
+    return dict(sections, AWSTemplateFormatVersion='2010-09-09',
+                Resources=resources)
+
+
+def instance(**properties):
+    return {'Type': 'AWS::EC2::Instance', 'Properties': properties}
+
+
+class DiffTemplatesTest(unittest.TestCase):
+    def test_unchanged(self):
+        old = template({'Router': instance(ImageId='ami-1')})
+        report = compare.diff_templates(old, json.loads(json.dumps(old)))
+        self.assertFalse(report['changed'])
+        self.assertEqual(report['resources'], {'added': [], 'removed': [],
+                                               'modified': []})
+        self.assertEqual(report['sections'], {})
+
+    def test_resources(self):
+        old = template({'Router': instance(ImageId='ami-1'),
+                        'OldCGW': {'Type': 'AWS::EC2::CustomerGateway'}})
+        new = template({'Router': instance(ImageId='ami-2'),
+                        'NewCGW': {'Type': 'AWS::EC2::CustomerGateway'}})
+        report = compare.diff_templates(old, new)
+        self.assertTrue(report['changed'])
+        self.assertEqual(report['resources'], {
+            'added': [{'id': 'NewCGW', 'type': 'AWS::EC2::CustomerGateway'}],
+            'removed': [{'id': 'OldCGW',
+                         'type': 'AWS::EC2::CustomerGateway'}],
+            'modified': [{'id': 'Router', 'type': 'AWS::EC2::Instance',
+                          'changes': [{'path': 'Properties.ImageId',
+                                       'old': 'ami-1', 'new': 'ami-2'}]}],
+        })
+
+    def test_paths(self):
+        old = template({'Router': instance(Tags=[{'Key': 'a', 'Value': '1'},
+                                                 {'Key': 'b', 'Value': '1'}])})
+        new = template({'Router': instance(Tags=[{'Key': 'a', 'Value': '1'},
+                                                 {'Key': 'b', 'Value': '2'},
+                                                 {'Key': 'c', 'Value': '3'}],
+                                           UserData='x')})
+        changes = compare.diff_templates(old, new)['resources']['modified'][
+            0]['changes']
+        self.assertEqual(changes, [
+            {'path': 'Properties.Tags[1].Value', 'old': '1', 'new': '2'},
+            {'path': 'Properties.Tags[2]', 'new': {'Key': 'c', 'Value': '3'}},
+            {'path': 'Properties.UserData', 'new': 'x'},
+        ])
+
+    def test_null_is_not_missing(self):
+        old = template({'Router': instance(KeyName=None)})
+        new = template({'Router': instance()})
+        report = compare.diff_templates(old, new)
+        self.assertTrue(report['changed'])
+        self.assertEqual(report['resources']['modified'][0]['changes'],
+                         [{'path': 'Properties.KeyName', 'old': None}])
+        # and back, including in the report's JSON
+        report = json.loads(json.dumps(compare.diff_templates(new, old)))
+        self.assertEqual(report['resources']['modified'][0]['changes'],
+                         [{'path': 'Properties.KeyName', 'new': None}])
+
+    def test_null_list_item(self):
+        changes = compare.diff_values([1, None], [1])
+        self.assertEqual(changes, [{'path': '[1]', 'old': None}])
+
+    def test_sections(self):
+        old = template({}, Outputs={'A': {'Value': '1'}, 'B': {'Value': '1'}},
+                       Description='old')
+        new = template({}, Outputs={'A': {'Value': '2'}}, Description='new')
+        report = compare.diff_templates(old, new)
+        self.assertTrue(report['changed'])
+        self.assertEqual(report['sections']['Outputs'], {
+            'added': [],
+            'removed': [{'id': 'B'}],
+            'modified': [{'id': 'A', 'changes': [
+                {'path': 'Value', 'old': '1', 'new': '2'}]}],
+        })
+        self.assertEqual(report['sections']['Template']['modified'][0][
+            'changes'], [{'path': 'Description', 'old': 'old',
+                          'new': 'new'}])
+        self.assertFalse('Parameters' in report['sections'])
+
+
+class FormatReportTest(unittest.TestCase):
+    def test_format(self):
+        old = template({'Router': instance(ImageId='ami-1', KeyName=None),
+                        'OldCGW': {'Type': 'AWS::EC2::CustomerGateway'}})
+        new = template({'Router': instance(ImageId='ami-2', SubnetId='s')})
+        report = compare.diff_templates(old, new)
+        report['resources']['modified'][0]['replacement'] = 'True'
+        self.assertEqual(compare.format_report(report, 'ohio').split('\n'), [
+            'ohio: 0 resources added, 1 removed, 1 modified',
+            '- Resources OldCGW (AWS::EC2::CustomerGateway)',
+            '~ Resources Router (AWS::EC2::Instance) [replacement: True]',
+            '    Properties.ImageId: "ami-1" -> "ami-2"',
+            '    Properties.KeyName: null -> (none)',
+            '    Properties.SubnetId: (none) -> "s"',
+        ])
+
+    def test_long_values(self):
+        self.assertEqual(compare.format_value('x' * 100),
+                         '"' + 'x' * 76 + '...')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Merging the template and stack configuration files, in a scratch copy of
+# configuration/templates with a stack of the test's own.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+import templates
+
+CONFIGURATION_DIR = os.path.abspath('configuration')
+
+
+class MergeTest(unittest.TestCase):
+    def test_dictionaries(self):
+        self.assertEqual(templates.merge({'a': {'b': 1, 'c': 2}},
+                                         {'a': {'c': 3}, 'd': 4}),
+                         {'a': {'b': 1, 'c': 3}, 'd': 4})
+
+    def test_lists_add(self):
+        self.assertEqual(templates.merge({'services': {'enabled': ['a']}},
+                                         {'services': {'enabled': ['b', 'a']}}),
+                         {'services': {'enabled': ['a', 'b']}})
+
+    def test_proposals_replace(self):
+        default = {'ipsec': {
+            'ike_proposals': [{'encryption': 'aes128', 'hash': 'sha1',
+                               'dh_group': 2}],
+            'esp_proposals': [{'encryption': 'aes128', 'hash': 'sha1'}],
+        }}
+        stack = {'ipsec': {
+            'esp_proposals': [{'encryption': 'aes256gcm128',
+                               'hash': 'sha256'}],
+        }}
+        merged = templates.merge(default, stack)
+        self.assertEqual(merged['ipsec']['esp_proposals'],
+                         [{'encryption': 'aes256gcm128', 'hash': 'sha256'}])
+        self.assertEqual(merged['ipsec']['ike_proposals'],
+                         [{'encryption': 'aes128', 'hash': 'sha1',
+                           'dh_group': 2}])
+
+    def test_replaced_only_at_their_path(self):
+        # a list of the same name elsewhere is still added to
+        self.assertEqual(templates.merge({'esp_proposals': ['a']},
+                                         {'esp_proposals': ['b']}),
+                         {'esp_proposals': ['a', 'b']})
+
+
+class StackConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        shutil.copytree(os.path.join(CONFIGURATION_DIR, 'templates'),
+                        os.path.join(self.directory, 'configuration',
+                                     'templates'))
+        os.makedirs(os.path.join(self.directory, 'configuration', 'stacks',
+                                 'test-wan'))
+        os.chdir(self.directory)
+        templates.stack_configs.clear()
+
+    def tearDown(self):
+        os.chdir(self.saved)
+        templates.stack_configs.clear()
+        shutil.rmtree(self.directory)
+
+    def write_stack(self, stack_config):
+        with open('configuration/stacks/test-wan/config.yaml', 'w') as f:
+            yaml.safe_dump(dict(stack_config, template_name='wan',
+                                region='us-east-2'), f)
+
+    def test_default_proposals(self):
+        self.write_stack({})
+        ipsec = templates.config('test-wan')['ipsec']
+        self.assertEqual(ipsec['esp_proposals'],
+                         [{'encryption': 'aes128', 'hash': 'sha1'}])
+
+    def test_stack_proposals_win(self):
+        proposals = [{'encryption': 'aes256gcm128', 'hash': 'sha256'},
+                     {'encryption': 'aes256', 'hash': 'sha256'}]
+        self.write_stack({'ipsec': {'esp_proposals': proposals}})
+        ipsec = templates.config('test-wan')['ipsec']
+        self.assertEqual(ipsec['esp_proposals'], proposals)
+        self.assertEqual(ipsec['maximum_paths'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
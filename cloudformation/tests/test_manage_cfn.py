@@ -0,0 +1,185 @@
+# manage-cfn's waiting for and following of stacks, against fake boto3
+# stacks which go through a list of statuses and then disappear, like a
+# deleted stack does.
+
+import unittest
+
+import botocore.exceptions
+
+import templates.trace
+
+from scripts import load_script
+
+manage_cfn = load_script('manage-cfn')
+
+
+def does_not_exist(stack_name):
+    return botocore.exceptions.ClientError({'Error': {
+        'Code': 'ValidationError',
+        'Message': 'Stack with id %s does not exist' % stack_name,
+    }}, 'DescribeStacks')
+
+
+class Events(object):
+    def all(self):
+        return []
+
+
+class Stack(object):
+    "Has each of 'statuses' after a reload, then doesn't exist"
+
+    def __init__(self, name, statuses):
+        self.name = self.stack_name = name
+        self.statuses = list(statuses)
+        self.status = self.statuses.pop(0) if self.statuses else None
+        self.events = Events()
+
+    @property
+    def stack_status(self):
+        if self.status is None:
+            raise does_not_exist(self.name)
+        return self.status
+
+    def reload(self):
+        if not self.statuses:
+            self.status = None
+            raise does_not_exist(self.name)
+        self.status = self.statuses.pop(0)
+
+    def delete(self):
+        pass
+
+
+class Resource(object):
+    def __init__(self, stacks):
+        self.stacks = stacks
+
+    def Stack(self, stack_name):
+        return self.stacks[stack_name]
+
+
+class StackTestCase(unittest.TestCase):
+    ARGUMENTS = {'--tail': True, '--trace': None, '--force': True,
+                 '--stack': 'ohio'}
+
+    def setUp(self):
+        self.saved = (manage_cfn.POLL_INTERVAL_MIN,
+                      manage_cfn.REGION_CALL_INTERVAL, manage_cfn.tracer,
+                      manage_cfn.aws_resource, manage_cfn.templates.config)
+        manage_cfn.POLL_INTERVAL_MIN = 0
+        manage_cfn.REGION_CALL_INTERVAL = 0
+        manage_cfn.rate_limiters.clear()
+        manage_cfn.tracer = templates.trace.Tracer()
+        self.stacks = {}
+        manage_cfn.aws_resource = (lambda region, profile, service:
+                                   Resource(self.stacks))
+        manage_cfn.templates.config = lambda stack_name: {
+            'region': 'us-east-2', 'profile': 'default'}
+
+    def tearDown(self):
+        (manage_cfn.POLL_INTERVAL_MIN, manage_cfn.REGION_CALL_INTERVAL,
+         manage_cfn.tracer, manage_cfn.aws_resource,
+         manage_cfn.templates.config) = self.saved
+        manage_cfn.rate_limiters.clear()
+
+
+class WaitTest(StackTestCase):
+    def test_wait_for_delete(self):
+        stack = Stack('ohio', ['DELETE_IN_PROGRESS', 'DELETE_IN_PROGRESS'])
+        self.assertEqual(manage_cfn.wait_for_update_to_complete(stack, None,
+                                                                'us-east-2'),
+                         'DELETE_COMPLETE')
+
+    def test_wait_for_update(self):
+        stack = Stack('ohio', ['UPDATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS',
+                               'UPDATE_COMPLETE'])
+        self.assertEqual(manage_cfn.wait_for_update_to_complete(stack, None,
+                                                                'us-east-2'),
+                         'UPDATE_COMPLETE')
+
+    def test_down(self):
+        self.stacks['ohio'] = Stack('ohio', ['CREATE_COMPLETE',
+                                             'DELETE_IN_PROGRESS'])
+        self.assertEqual(manage_cfn.down_stack(dict(self.ARGUMENTS)), 0)
+
+    def test_down_already_gone_when_tailed(self):
+        self.stacks['ohio'] = Stack('ohio', ['CREATE_COMPLETE'])
+        self.assertEqual(manage_cfn.down_stack(dict(self.ARGUMENTS)), 0)
+
+    def test_tail_missing_stack(self):
+        self.stacks['ohio'] = Stack('ohio', [])
+        self.assertEqual(manage_cfn.tail('us-east-2', 'default', 'ohio', None,
+                                         dict(self.ARGUMENTS)), 1)
+
+
+class TailStacksTest(StackTestCase):
+    def setUp(self):
+        StackTestCase.setUp(self)
+        self.saved_names = manage_cfn.templates.stack_names
+        manage_cfn.templates.stack_names = lambda: sorted(self.stacks)
+
+    def tearDown(self):
+        manage_cfn.templates.stack_names = self.saved_names
+        StackTestCase.tearDown(self)
+
+    def test_deleted_while_tailed(self):
+        self.stacks['ohio'] = Stack('ohio', ['DELETE_IN_PROGRESS',
+                                             'DELETE_IN_PROGRESS'])
+        self.stacks['ohio-wan'] = Stack('ohio-wan', ['UPDATE_IN_PROGRESS',
+                                                     'UPDATE_IN_PROGRESS',
+                                                     'UPDATE_COMPLETE'])
+        self.assertEqual(manage_cfn.tail_stacks({'--stack': 'ohio*'}), 0)
+
+    def test_gone_while_updating(self):
+        self.stacks['ohio'] = Stack('ohio', ['UPDATE_IN_PROGRESS',
+                                             'UPDATE_IN_PROGRESS'])
+        self.assertEqual(manage_cfn.tail_stacks({'--stack': 'ohio'}), 1)
+
+
+class AllStacksTest(StackTestCase):
+    "up-all and down-all of a VPC stack and its WAN stack"
+
+    ARGUMENTS = dict(StackTestCase.ARGUMENTS, **{'--concurrency': '4',
+                                                 '--keep-going': False})
+
+    def setUp(self):
+        StackTestCase.setUp(self)
+        self.saved_all = (manage_cfn.templates.configs,
+                          manage_cfn.stack_dependencies, manage_cfn.up_stack)
+        manage_cfn.templates.configs = lambda: {
+            'ohio': {'region': 'us-east-2', 'profile': 'default'},
+            'ohio-wan': {'region': 'us-east-2', 'profile': 'default'},
+        }
+        manage_cfn.stack_dependencies = lambda configs: {
+            'ohio': set(), 'ohio-wan': set(['ohio'])}
+        self.created = []
+        manage_cfn.up_stack = lambda arguments: self.created.append(
+            arguments['--stack'])
+
+    def tearDown(self):
+        (manage_cfn.templates.configs, manage_cfn.stack_dependencies,
+         manage_cfn.up_stack) = self.saved_all
+        StackTestCase.tearDown(self)
+
+    def test_down_all(self):
+        self.stacks['ohio'] = Stack('ohio', ['CREATE_COMPLETE',
+                                             'DELETE_IN_PROGRESS'])
+        self.stacks['ohio-wan'] = Stack('ohio-wan', ['UPDATE_COMPLETE',
+                                                     'DELETE_IN_PROGRESS'])
+        self.assertEqual(manage_cfn.down_all_stacks(dict(self.ARGUMENTS)), 0)
+
+    def test_up_all_rolled_back_update_is_up(self):
+        self.stacks['ohio'] = Stack('ohio', ['UPDATE_ROLLBACK_COMPLETE'])
+        self.stacks['ohio-wan'] = Stack('ohio-wan', [])
+        self.assertEqual(manage_cfn.up_all_stacks(dict(self.ARGUMENTS)), 0)
+        self.assertEqual(self.created, ['ohio-wan'])
+
+    def test_up_all_failed_creation(self):
+        self.stacks['ohio'] = Stack('ohio', ['ROLLBACK_COMPLETE'])
+        self.stacks['ohio-wan'] = Stack('ohio-wan', [])
+        self.assertEqual(manage_cfn.up_all_stacks(dict(self.ARGUMENTS)), 1)
+        self.assertEqual(self.created, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
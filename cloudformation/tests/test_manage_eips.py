@@ -0,0 +1,187 @@
+# manage-eips' plan and its application, against a fake EC2 connection per
+# region.
+
+import unittest
+
+from scripts import load_script
+
+manage_eips = load_script('manage-eips')
+
+
+class Address(object):
+    def __init__(self, allocation_id, public_ip):
+        self.allocation_id = allocation_id
+        self.public_ip = public_ip
+
+
+class EC2(object):
+    "The VPC addresses of a region; fails the calls listed in 'failing'"
+
+    def __init__(self, region, addresses=None):
+        self.region = region
+        self.addresses = dict(addresses or {})
+        self.failing = set()
+        self.allocations = 0
+
+    def get_all_addresses(self):
+        return [Address(allocation_id, public_ip)
+                for allocation_id, public_ip in self.addresses.items()]
+
+    def allocate_address(self, domain):
+        if 'allocate' in self.failing:
+            raise Exception('AddressLimitExceeded')
+        self.allocations += 1
+        address = Address('eipalloc-%s-%d' % (self.region, self.allocations),
+                          '1.2.3.%d' % self.allocations)
+        self.addresses[address.allocation_id] = address.public_ip
+        return address
+
+    def release_address(self, allocation_id):
+        if 'release' in self.failing:
+            raise Exception('InvalidAddress.InUse')
+        del self.addresses[allocation_id]
+
+
+VPCS = {
+    'ohio': {'region': 'us-east-2'},
+    'oregon': {'region': 'us-west-2'},
+    'office': {},
+}
+
+
+class ManageEipsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict(manage_eips.connections)
+        manage_eips.connections.clear()
+        self.ec2 = {
+            'us-east-1': EC2('us-east-1', {'eipalloc-old': '9.9.9.9'}),
+            'us-east-2': EC2('us-east-2', {'eipalloc-ohio': '5.5.5.5'}),
+            'us-west-2': EC2('us-west-2'),
+        }
+        manage_eips.connections.update(self.ec2)
+
+    def tearDown(self):
+        manage_eips.connections.clear()
+        manage_eips.connections.update(self.saved)
+
+    def addresses(self):
+        return manage_eips.map_regions(manage_eips.snapshot, self.ec2, 4)
+
+    def plan(self, eips):
+        return [(x['action'], x['name'], x['region'], x.get('allocation_id'))
+                for x in manage_eips.plan(VPCS, eips, self.addresses())]
+
+
+class PlanTest(ManageEipsTestCase):
+    def test_in_line(self):
+        eips = {'ohio': {'allocation_id': 'eipalloc-ohio',
+                         'public_ip': '5.5.5.5', 'region': 'us-east-2'},
+                'oregon': {'allocation_id': 'eipalloc-oregon-1',
+                           'public_ip': '1.2.3.1', 'region': 'us-west-2'}}
+        self.ec2['us-west-2'].addresses['eipalloc-oregon-1'] = '1.2.3.1'
+        self.assertEqual(self.plan(eips), [])
+
+    def test_new_vpcs(self):
+        self.assertEqual(self.plan({}), [
+            ('allocate', 'ohio', 'us-east-2', None),
+            ('allocate', 'oregon', 'us-west-2', None),
+        ])
+
+    def test_region_mismatch(self):
+        eips = {'ohio': {'allocation_id': 'eipalloc-old',
+                         'public_ip': '9.9.9.9', 'region': 'us-east-1'}}
+        self.assertEqual(self.plan(eips), [
+            ('release', 'ohio', 'us-east-1', 'eipalloc-old'),
+            ('allocate', 'ohio', 'us-east-2', None),
+            ('allocate', 'oregon', 'us-west-2', None),
+        ])
+
+    def test_region_mismatch_already_released(self):
+        del self.ec2['us-east-1'].addresses['eipalloc-old']
+        eips = {'ohio': {'allocation_id': 'eipalloc-old',
+                         'public_ip': '9.9.9.9', 'region': 'us-east-1'}}
+        self.assertEqual(self.plan(eips)[0],
+                         ('forget', 'ohio', 'us-east-1', 'eipalloc-old'))
+
+    def test_missing_address_and_region(self):
+        eips = {'ohio': {'allocation_id': 'eipalloc-gone',
+                         'public_ip': '5.5.5.6', 'region': 'us-east-2'},
+                'oregon': {'allocation_id': 'eipalloc-oregon-1',
+                           'public_ip': '1.2.3.1'}}
+        self.assertEqual(self.plan(eips), [
+            ('allocate', 'ohio', 'us-east-2', None),
+            ('add-region', 'oregon', 'us-west-2', 'eipalloc-oregon-1'),
+        ])
+
+    def test_removed_vpc(self):
+        eips = {'ohio': {'allocation_id': 'eipalloc-ohio',
+                         'public_ip': '5.5.5.5', 'region': 'us-east-2'},
+                'virginia': {'allocation_id': 'eipalloc-old',
+                             'public_ip': '9.9.9.9', 'region': 'us-east-1'}}
+        self.assertEqual(self.plan(eips), [
+            ('allocate', 'oregon', 'us-west-2', None),
+            ('release', 'virginia', 'us-east-1', 'eipalloc-old'),
+        ])
+
+
+class ApplyPlanTest(ManageEipsTestCase):
+    def setUp(self):
+        ManageEipsTestCase.setUp(self)
+        self.eips = {'ohio': {'allocation_id': 'eipalloc-old',
+                              'public_ip': '9.9.9.9', 'region': 'us-east-1'}}
+
+    def apply_plan(self):
+        actions = manage_eips.plan(VPCS, self.eips, self.addresses())
+        return manage_eips.apply_plan(actions, self.eips, 4)
+
+    def test_region_mismatch(self):
+        self.assertEqual(self.apply_plan(), True)
+        self.assertEqual(self.eips, {
+            'ohio': {'allocation_id': 'eipalloc-us-east-2-1',
+                     'public_ip': '1.2.3.1', 'region': 'us-east-2'},
+            'oregon': {'allocation_id': 'eipalloc-us-west-2-1',
+                       'public_ip': '1.2.3.1', 'region': 'us-west-2'},
+        })
+        self.assertEqual(self.ec2['us-east-1'].addresses, {})
+
+    def test_allocation_fails(self):
+        self.ec2['us-west-2'].failing.add('allocate')
+        before = dict(self.eips)
+        self.assertEqual(self.apply_plan(), None)
+        self.assertEqual(self.eips, before)
+        # ohio's new address is released again, its old one is left alone
+        self.assertEqual(self.ec2['us-east-2'].addresses,
+                         {'eipalloc-ohio': '5.5.5.5'})
+        self.assertEqual(self.ec2['us-east-1'].addresses,
+                         {'eipalloc-old': '9.9.9.9'})
+
+    def test_release_fails(self):
+        self.ec2['us-east-1'].failing.add('release')
+        self.assertEqual(self.apply_plan(), False)
+        self.assertEqual(self.eips['ohio']['allocation_id'],
+                         'eipalloc-us-east-2-1')
+        self.assertEqual(self.eips['ohio-unreleased-eipalloc-old'], {
+            'allocation_id': 'eipalloc-old', 'public_ip': '9.9.9.9',
+            'region': 'us-east-1'})
+
+        # and the next run releases it
+        self.ec2['us-east-1'].failing.clear()
+        self.assertEqual(self.plan(self.eips), [
+            ('release', 'ohio-unreleased-eipalloc-old', 'us-east-1',
+             'eipalloc-old')])
+        self.assertEqual(self.apply_plan(), True)
+        self.assertEqual(sorted(self.eips), ['ohio', 'oregon'])
+        self.assertEqual(self.ec2['us-east-1'].addresses, {})
+
+    def test_removed_vpc_release_fails(self):
+        self.eips = {'virginia': {'allocation_id': 'eipalloc-old',
+                                  'public_ip': '9.9.9.9',
+                                  'region': 'us-east-1'}}
+        self.ec2['us-east-1'].failing.add('release')
+        self.assertEqual(self.apply_plan(), False)
+        self.assertEqual(self.eips['virginia']['allocation_id'],
+                         'eipalloc-old')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# templates.topology against small vpcs.yaml contents and the repository's
+# own configuration/vpcs.yaml.
+
+import unittest
+
+import yaml
+
+import templates.topology as topology
+
+VPCS = {
+    'virginia-hub': {'region': 'us-east-1', 'cidr': '192.168.250.0/28'},
+    'virginia-hub-2': {'region': 'us-east-1', 'cidr': '192.168.251.0/28'},
+    'oregon-hub': {'region': 'us-west-2', 'cidr': '192.168.252.0/28'},
+    'virginia': {'region': 'us-east-1', 'cidr': '192.168.240.0/24'},
+    'ohio': {'region': 'us-east-2', 'cidr': '192.168.230.0/24'},
+    'office': {'cidr': '10.0.0.0/16'},
+}
+
+
+def connections(**connections):
+    return topology.Topology({'vpcs': VPCS, 'connections': connections})
+
+
+class IndexTest(unittest.TestCase):
+    def test_index(self):
+        wan = connections(
+            east={'to': ['virginia-hub'], 'from': ['virginia', 'ohio']},
+            west={'to': ['oregon-hub'], 'from': ['ohio', {'office': None}]})
+        self.assertEqual(wan.incoming['virginia-hub'], ['virginia', 'ohio'])
+        self.assertEqual(wan.outgoing['ohio'], ['virginia-hub', 'oregon-hub'])
+        self.assertEqual(wan.hubs, set(['virginia-hub', 'oregon-hub']))
+        self.assertEqual(wan.spokes, set(['virginia', 'ohio', 'office']))
+        self.assertEqual(wan.cgw_hubs[('us-west-2', 'office')],
+                         ['oregon-hub'])
+
+    def test_empty(self):
+        wan = topology.Topology({'vpcs': VPCS, 'connections': None})
+        self.assertEqual(wan.validate(), [])
+        self.assertEqual(wan.hubs, set())
+
+    def test_router_slice(self):
+        wan = connections(
+            east={'to': ['virginia-hub'], 'from': ['ohio']},
+            west={'to': ['oregon-hub'], 'from': ['ohio']})
+        self.assertEqual(wan.router_slice('ohio'), {
+            'vpc': 'ohio',
+            'outgoing': ['virginia-hub', 'oregon-hub'],
+            'vpcs': {'ohio': VPCS['ohio'],
+                     'virginia-hub': VPCS['virginia-hub'],
+                     'oregon-hub': VPCS['oregon-hub']},
+        })
+
+
+class ValidateTest(unittest.TestCase):
+    def test_valid(self):
+        # hubs in different regions may each take the same spoke
+        wan = connections(
+            east={'to': ['virginia-hub'], 'from': ['virginia', 'ohio']},
+            west={'to': ['oregon-hub'], 'from': ['virginia', 'ohio']})
+        self.assertEqual(wan.validate(), [])
+
+    def test_same_connection_twice(self):
+        wan = connections(
+            a={'to': ['virginia-hub'], 'from': ['ohio']},
+            b={'to': ['virginia-hub'], 'from': ['ohio']})
+        self.assertEqual(wan.validate(), [])
+
+    def test_incoming_and_outgoing(self):
+        wan = connections(
+            east={'to': ['virginia-hub'], 'from': ['ohio']},
+            west={'to': ['ohio'], 'from': ['virginia']})
+        self.assertEqual(wan.validate(),
+                         ['ohio: has both incoming and outgoing connections'])
+
+    def test_one_cgw_per_region(self):
+        wan = connections(
+            east={'to': ['virginia-hub', 'virginia-hub-2', 'oregon-hub'],
+                  'from': ['ohio']})
+        self.assertEqual(wan.validate(), [
+            'ohio: connects to more than one hub in us-east-1: '
+            'virginia-hub, virginia-hub-2'])
+
+    def test_one_cgw_per_region_across_connections(self):
+        wan = connections(
+            a={'to': ['virginia-hub'], 'from': ['ohio', 'virginia']},
+            b={'to': ['virginia-hub-2'], 'from': ['office', 'virginia']})
+        self.assertEqual(wan.validate(), [
+            'virginia: connects to more than one hub in us-east-1: '
+            'virginia-hub, virginia-hub-2'])
+
+    def test_hub_outside_aws(self):
+        # a hub without a region has no CGW's of its own to limit
+        wan = connections(
+            a={'to': ['office'], 'from': ['ohio']},
+            b={'to': ['virginia-hub'], 'from': ['ohio']})
+        self.assertEqual(wan.validate(), [])
+
+    def test_configuration(self):
+        with open('configuration/vpcs.yaml') as f:
+            vpcs_file = yaml.safe_load(f)
+        self.assertEqual(topology.Topology(vpcs_file).validate(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -76,6 +76,7 @@ cp ${SCRIPTS}/ec2-fetch-ssh-public-key /mnt/inst_root/etc/init.d/ec2-fetch-ssh-p
 chroot /mnt/inst_root insserv ec2-fetch-ssh-public-key --default
 
 cp ${SCRIPTS}/ha-nat /mnt/inst_root/usr/local/bin/ha-nat
+cp ${SCRIPTS}/tunnel-telemetry /mnt/inst_root/usr/local/bin/tunnel-telemetry
 
 # install our ipsec configuration scripts
 cp ${SCRIPTS}/configure-ipsec-client /mnt/inst_root/usr/local/bin/configure-ipsec-client
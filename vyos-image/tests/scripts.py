@@ -0,0 +1,36 @@
+# Loads the router scripts, which have no .py extension, as modules, and
+# finds the fixtures: command output and configurations captured on a router.
+
+import os
+import imp
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'scripts')
+FIXTURES_DIR = os.path.join(TESTS_DIR, 'fixtures')
+
+
+def script_path(name):
+  return os.path.join(SCRIPTS_DIR, name)
+
+
+def load_script(name):
+  # imp would leave a compiled '<name>c' next to the script
+  dont_write_bytecode = sys.dont_write_bytecode
+  sys.dont_write_bytecode = True
+  try:
+    return imp.load_source(name.replace('-', '_'), script_path(name))
+  finally:
+    sys.dont_write_bytecode = dont_write_bytecode
+
+
+def fixture_path(*names):
+  return os.path.join(FIXTURES_DIR, *names)
+
+
+def read_fixture(*names):
+  f = open(fixture_path(*names))
+  try:
+    return f.read()
+  finally:
+    f.close()
@@ -0,0 +1,156 @@
+# configure-ipsec-client against the fixtures in
+# fixtures/configure-ipsec-client:
+#
+#   user-data/              the files of a router in /usr/local/etc, for
+#                           --offline: two hubs, two tunnels each
+#   desired.txt             the configuration generated from them
+#   running-<case>.txt      "show configuration commands" of a router, for
+#                           'openvpn-server' one with configure-openvpn-server's
+#                           NAT rule and route too
+#   changes-<case>.txt      the --dry-run output for that running configuration
+
+import shlex
+import subprocess
+import sys
+import unittest
+
+from scripts import load_script, script_path, fixture_path, read_fixture
+
+client = load_script('configure-ipsec-client')
+
+CASES = ['unchanged', 'tunnel-added', 'tunnel-removed', 'proposal-changed',
+  'openvpn-server']
+
+
+def fixture(name):
+  return fixture_path('configure-ipsec-client', name)
+
+
+def read_changes(case):
+  changes = []
+  for line in read_fixture('configure-ipsec-client',
+      'changes-%s.txt' % case).splitlines():
+    words = shlex.split(line)
+    changes.append((words[0], tuple(words[1:])))
+  return changes
+
+
+def desired_configuration():
+  return client.parse_configuration_commands(
+    read_fixture('configure-ipsec-client', 'desired.txt'))
+
+
+def diff(case):
+  return client.diff_configuration(desired_configuration(),
+    client.get_running_configuration(fixture('running-%s.txt' % case)))
+
+
+class GenerateConfigurationTest(unittest.TestCase):
+  def setUp(self):
+    self.saved = (client.config_dir, client.offline_instance)
+    client.config_dir = fixture('user-data')
+    client.offline_instance = client.read_instance_json()
+    client.configuration[:] = []
+
+  def tearDown(self):
+    client.config_dir, client.offline_instance = self.saved
+    client.configuration[:] = []
+
+  def test_offline(self):
+    self.assertTrue(client.generate_configuration())
+    self.assertEqual(client.configuration, desired_configuration())
+
+  def test_valid(self):
+    client.generate_configuration()
+    self.assertEqual(client.check_configuration(client.configuration), [])
+
+  def test_vti_bound_twice(self):
+    client.generate_configuration()
+    client.configuration.append(('vpn', 'ipsec', 'site-to-site', 'peer',
+      '9.9.9.9', 'vti', 'bind', 'vti1'))
+    self.assertTrue(client.check_configuration(client.configuration))
+
+
+class DiffConfigurationTest(unittest.TestCase):
+  def test_cases(self):
+    for case in CASES:
+      self.assertEqual(diff(case), read_changes(case), case)
+
+  def test_unchanged(self):
+    self.assertEqual(diff('unchanged'), [])
+
+  def test_tunnel_added(self):
+    changes = diff('tunnel-added')
+    self.assertEqual([x for x in changes if x[0] == 'delete'], [])
+    peers = set(words[4] for command, words in changes
+      if words[:3] == ('vpn', 'ipsec', 'site-to-site'))
+    self.assertEqual(peers, set(['2.2.2.4', '2.2.2.5']))
+
+  def test_tunnel_removed(self):
+    # the removed tunnel's nodes are deleted as a whole, nothing is set
+    self.assertEqual(diff('tunnel-removed'), [
+      ('delete', ('interfaces', 'vti', 'vti5')),
+      ('delete', ('protocols', 'bgp', '65002', 'neighbor', '169.254.9.1')),
+      ('delete', ('vpn', 'ipsec', 'site-to-site', 'peer', '3.3.3.3')),
+    ])
+
+  def test_proposal_changed(self):
+    changes = diff('proposal-changed')
+    commands = [command for command, words in changes]
+    # stale values are deleted before their replacements are set
+    self.assertEqual(commands, sorted(commands))
+    self.assertTrue(('delete', ('vpn', 'ipsec', 'ike-group', 'AWS',
+      'proposal', '1', 'encryption', 'aes128')) in changes)
+    self.assertTrue(('set', ('vpn', 'ipsec', 'ike-group', 'AWS',
+      'proposal', '1', 'encryption', 'aes256')) in changes)
+    self.assertEqual([words for command, words in changes
+      if 'site-to-site' in words], [])
+
+  def test_openvpn_server_left_alone(self):
+    # configure-openvpn-server's NAT rule and route survive a rerun
+    self.assertEqual(diff('openvpn-server'), [])
+    running = client.get_running_configuration(
+      fixture('running-openvpn-server.txt'))
+    for words in [('nat', 'source', 'rule', '200', 'outbound-interface',
+        'any'), ('protocols', 'static', 'interface-route', '10.206.109.0/24',
+        'next-hop-interface', 'vtun0')]:
+      self.assertTrue(words in running, words)
+      self.assertEqual(client.is_managed(words), None)
+
+  def test_unmanaged_left_alone(self):
+    for case in CASES:
+      for command, words in diff(case):
+        self.assertTrue(client.is_managed(words), words)
+
+
+class CommandLineTest(unittest.TestCase):
+  def run_client(self, *arguments):
+    process = subprocess.Popen([sys.executable,
+      script_path('configure-ipsec-client')] + list(arguments),
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = process.communicate()[0]
+    self.assertEqual(process.returncode, 0)
+    return output
+
+  def test_offline_dry_run(self):
+    for case in CASES:
+      output = self.run_client('--offline', fixture('user-data'),
+        '--running-config', fixture('running-%s.txt' % case), '--dry-run')
+      self.assertEqual(output, read_fixture('configure-ipsec-client',
+        'changes-%s.txt' % case), case)
+
+  def test_desired_config(self):
+    output = self.run_client('--desired-config', fixture('desired.txt'),
+      '--running-config', fixture('running-tunnel-removed.txt'))
+    self.assertTrue(output.startswith('#!/bin/vbash\n'))
+    self.assertTrue('delete vpn ipsec site-to-site peer 3.3.3.3\n' in output)
+    self.assertTrue(output.endswith('commit\nsave\nexit\n\n'))
+
+  def test_nothing_to_commit(self):
+    output = self.run_client('--desired-config', fixture('desired.txt'),
+      '--running-config', fixture('running-unchanged.txt'))
+    self.assertTrue(output.endswith('configure\n\nexit\n'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,346 @@
+# ha-nat's active/standby Monitor against fake EC2 and VPC connections which
+# share one route table and EIP, so that two (or three) routers can be run in
+# turns, on a fake clock.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import boto.exception
+
+from scripts import load_script
+
+ha_nat = load_script('ha-nat')
+
+
+class Route(object):
+  def __init__(self, destination, instance_id):
+    self.destination_cidr_block = destination
+    self.instance_id = instance_id
+    self.gateway_id = None
+    self.state = 'active'
+
+
+class RouteTable(object):
+  def __init__(self, id, logical_id, routes):
+    self.id = id
+    self.tags = {'aws:cloudformation:logical-id': logical_id}
+    self.routes = routes
+
+
+class Item(object):
+  def __init__(self, **attributes):
+    self.__dict__.update(attributes)
+
+
+class World(object):
+  "The AWS state both routers see, and their connections to it"
+
+  def __init__(self, instances, group='routers'):
+    self.instances = instances
+    self.group = group
+    self.routes = {'rtb-private': {}, 'rtb-public': {}}
+    self.eip = None
+    self.failing = False
+    # called after looking up instances and after replacing a route, to
+    # change the world between a router's check and its act
+    self.on_instances = None
+    self.on_replace = None
+    # the seconds each API call takes
+    self.clock = None
+
+  # VPC
+
+  def get_all_route_tables(self, route_table_ids=None, filters=None):
+    names = {'rtb-private': 'PrivateRouteTable',
+      'rtb-public': 'PublicRouteTable'}
+    return [RouteTable(id, names[id], [Route(destination, instance_id)
+      for destination, instance_id in sorted(self.routes[id].items())])
+      for id in sorted(self.routes)
+      if not route_table_ids or id in route_table_ids]
+
+  def create_route(self, route_table_id, destination, instance_id):
+    if self.failing:
+      raise boto.exception.EC2ResponseError(503, 'Unavailable')
+    if destination in self.routes[route_table_id]:
+      raise boto.exception.EC2ResponseError(400, 'RouteAlreadyExists')
+    self.routes[route_table_id][destination] = instance_id
+
+  def replace_route(self, route_table_id, destination, instance_id):
+    if self.failing:
+      raise boto.exception.EC2ResponseError(503, 'Unavailable')
+    self.routes[route_table_id][destination] = instance_id
+    if self.on_replace:
+      self.on_replace(route_table_id, destination)
+
+  # EC2
+
+  def get_all_tags(self, filters):
+    if self.group:
+      return [Item(value=self.group)]
+    return []
+
+  def get_only_instances(self, instance_ids=None, filters=None):
+    if self.on_instances:
+      self.on_instances()
+    return [Item(id=id, private_ip_address='10.0.0.%d' % index,
+      state='running') for index, id in enumerate(self.instances)
+      if not instance_ids or id in instance_ids]
+
+  def get_all_addresses(self, allocation_ids):
+    return [Item(allocation_id=allocation_ids[0], instance_id=self.eip)]
+
+  def associate_address(self, allocation_id, instance_id,
+      allow_reassociation):
+    if self.clock:
+      self.clock.now += 1
+    self.eip = instance_id
+    return True
+
+  def default_route_owner(self):
+    return self.routes['rtb-private'].get(ha_nat.DEFAULT_ROUTE)
+
+
+class Clock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+
+class Options(object):
+  interval = 2
+  failures = 3
+  hold_down = 60
+
+  def __init__(self, events):
+    self.events = events
+
+
+class MonitorTest(unittest.TestCase):
+  def setUp(self):
+    self.config_dir = tempfile.mkdtemp()
+    f = open(os.path.join(self.config_dir, 'eips.yaml'), 'w')
+    f.write('ohio:\n  public_ip: 5.5.5.5\n  allocation_id: eipalloc-1\n')
+    f.close()
+
+    self.saved = (ha_nat.CONFIG_DIR, ha_nat.ROUTE_RETRY_DELAY,
+      ha_nat.time.sleep, ha_nat.time.time, ha_nat.ping)
+    ha_nat.CONFIG_DIR = self.config_dir
+    ha_nat.ROUTE_RETRY_DELAY = 0
+    ha_nat.time.sleep = lambda seconds: None
+    self.clock = Clock()
+    ha_nat.time.time = self.clock.time
+    self.reachable = True
+    ha_nat.ping = lambda address: self.reachable
+
+  def tearDown(self):
+    (ha_nat.CONFIG_DIR, ha_nat.ROUTE_RETRY_DELAY, ha_nat.time.sleep,
+      ha_nat.time.time, ha_nat.ping) = self.saved
+    shutil.rmtree(self.config_dir)
+
+  def monitor(self, world, instance_id):
+    public_route_table, private_route_table = ha_nat.get_route_tables(world,
+      'vpc-1')
+    return ha_nat.Monitor(Options(os.path.join(self.config_dir, 'events')),
+      world, world, 'ohio', instance_id, public_route_table,
+      private_route_table)
+
+  def events(self):
+    path = os.path.join(self.config_dir, 'events')
+    if not os.path.exists(path):
+      return []
+    f = open(path)
+    try:
+      return [json.loads(line) for line in f]
+    finally:
+      f.close()
+
+  def active_and_standby(self, world):
+    "'i-a' active, 'i-b' its standby, which found it healthy"
+    a, b = self.monitor(world, 'i-a'), self.monitor(world, 'i-b')
+    a.check()
+    b.check()
+    self.assertTrue(a.active)
+    self.assertFalse(b.active)
+    return a, b
+
+  def rounds(self, monitor, count):
+    for round in range(count):
+      self.clock.now += Options.interval
+      monitor.check()
+
+  def test_standby_takes_over_after_failures(self):
+    world = World(['i-a', 'i-b'])
+    world.clock = self.clock
+    a, b = self.active_and_standby(world)
+    healthy = self.clock.now
+
+    self.reachable = False
+    self.rounds(b, Options.failures - 1)
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-a')
+
+    self.rounds(b, 1)
+    self.assertTrue(b.active)
+    self.assertEqual(world.routes['rtb-private'], {ha_nat.DEFAULT_ROUTE: 'i-b'})
+    self.assertEqual(set(world.routes['rtb-public'].values()), set(['i-b']))
+    self.assertEqual(world.eip, 'i-b')
+
+    take_over = self.events()[-1]
+    self.assertEqual(take_over['event'], 'take-over')
+    self.assertEqual(take_over['peer'], 'i-a')
+    self.assertEqual(take_over['reason'], '%d failed health checks' %
+      Options.failures)
+    detection = Options.failures * Options.interval
+    self.assertEqual(take_over['detection_seconds'], detection)
+    # the EIP association took a second
+    self.assertEqual(take_over['take_over_seconds'], 1)
+    self.assertEqual(take_over['failover_seconds'], detection + 1)
+    self.assertEqual(self.clock.now - healthy, detection + 1)
+
+    # the old active router steps down and leaves the EIP alone
+    self.reachable = True
+    a.check()
+    self.assertFalse(a.active)
+    self.assertEqual(world.eip, 'i-b')
+
+  def test_recovered_standby_resets_failures(self):
+    world = World(['i-a', 'i-b'])
+    a, b = self.active_and_standby(world)
+
+    self.reachable = False
+    self.rounds(b, Options.failures - 1)
+    self.reachable = True
+    self.rounds(b, 1)
+    self.reachable = False
+    self.rounds(b, Options.failures - 1)
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-a')
+
+  def test_hold_down(self):
+    world = World(['i-a', 'i-b'])
+    a, b = self.active_and_standby(world)
+
+    # 'i-b' takes over, 'i-a' loses the routes and then can't reach 'i-b'
+    self.reachable = False
+    self.rounds(b, Options.failures)
+    a.check()
+    self.assertFalse(a.active)
+
+    self.rounds(a, Options.failures + 1)
+    self.assertFalse(a.active)
+    self.assertEqual(world.default_route_owner(), 'i-b')
+
+    self.clock.now += Options.hold_down
+    a.check()
+    self.assertTrue(a.active)
+    self.assertEqual(world.default_route_owner(), 'i-a')
+
+  def test_fence_route_changed_before_take_over(self):
+    world = World(['i-a', 'i-b', 'i-c'])
+    a, b = self.active_and_standby(world)
+
+    self.reachable = False
+    self.rounds(b, Options.failures - 1)
+
+    # 'i-c' takes over between 'i-b's last health check and its take over
+    def take_over():
+      world.routes['rtb-private'][ha_nat.DEFAULT_ROUTE] = 'i-c'
+    world.on_instances = take_over
+    self.rounds(b, 1)
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-c')
+    self.assertEqual(world.eip, 'i-a')
+    self.assertEqual([x['event'] for x in self.events()], ['take-over'])
+
+  def test_fence_race_backs_off(self):
+    world = World(['i-a', 'i-b', 'i-c'])
+    a, b = self.active_and_standby(world)
+
+    # 'i-c' writes the default route right after 'i-b' did
+    def take_over(route_table_id, destination):
+      if destination == ha_nat.DEFAULT_ROUTE:
+        world.on_replace = None
+        world.routes['rtb-private'][destination] = 'i-c'
+    world.on_replace = take_over
+
+    self.reachable = False
+    self.rounds(b, Options.failures)
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-c')
+    self.assertEqual(world.eip, 'i-a')
+
+    # and health checks 'i-c' from then on
+    self.reachable = True
+    self.rounds(b, 1)
+    self.assertEqual(b.peer, 'i-c')
+    self.assertEqual(b.failures, 0)
+
+  def test_no_owner_lowest_instance_id_takes_over(self):
+    world = World(['i-b', 'i-a'])
+    a, b = self.monitor(world, 'i-a'), self.monitor(world, 'i-b')
+
+    # 'i-b' finds nobody active first, but waits for 'i-a'
+    b.check()
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), None)
+
+    a.check()
+    b.check()
+    self.assertTrue(a.active)
+    self.assertFalse(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-a')
+    self.assertEqual(world.eip, 'i-a')
+
+  def test_no_owner_others_take_over_after_failures(self):
+    world = World(['i-a', 'i-b'])
+    b = self.monitor(world, 'i-b')
+
+    for round in range(Options.failures - 1):
+      b.check()
+      self.assertFalse(b.active)
+    b.check()
+    self.assertTrue(b.active)
+    self.assertEqual(world.default_route_owner(), 'i-b')
+
+  def test_active_reclaims_eip(self):
+    world = World(['i-a', 'i-b'])
+    a = self.monitor(world, 'i-a')
+    a.check()
+    self.assertEqual(world.eip, 'i-a')
+
+    world.eip = 'i-b'
+    a.check()
+    self.assertEqual(world.eip, 'i-a')
+
+  def test_step_down_leaves_eip(self):
+    world = World(['i-a', 'i-b'])
+    a = self.monitor(world, 'i-a')
+    a.check()
+
+    world.routes['rtb-private'][ha_nat.DEFAULT_ROUTE] = 'i-b'
+    a.check()
+    self.assertFalse(a.active)
+    self.assertEqual(world.eip, 'i-a')
+
+  def test_failed_reconcile_not_active(self):
+    world = World(['i-a', 'i-b'])
+    a = self.monitor(world, 'i-a')
+
+    world.failing = True
+    a.check()
+    self.assertFalse(a.active)
+    self.assertEqual(world.eip, None)
+
+    world.failing = False
+    a.check()
+    self.assertTrue(a.active)
+    self.assertEqual(world.eip, 'i-a')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,286 @@
+# tunnel-telemetry against the fixtures in fixtures/tunnel-telemetry, the
+# command output of a router with two tunnels to one hub (vti1 up, vti2's
+# peer still connecting), sampled in turns:
+#
+#   sample-1/    every file --from-dir reads: net-dev, ip-address,
+#                ipsec-statusall, bgp-summary and ping-<vti>
+#   sample-2/    traffic on both tunnels, vti1's child SA rekeyed and its
+#                BGP session down
+#   sample-3/    vti1's BGP session back, one prefix received
+#   sample-4/    both prefixes received
+#
+# A sample's directory only has the files which changed since the previous
+# one.
+
+import os
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from scripts import load_script, script_path, fixture_path, read_fixture
+
+telemetry = load_script('tunnel-telemetry')
+
+
+def fixture(*names):
+  return fixture_path('tunnel-telemetry', *names)
+
+
+def read_sample(sample, name):
+  return read_fixture('tunnel-telemetry', 'sample-%d' % sample, name)
+
+
+class Samples(telemetry.Sources):
+  "The files of sample 'sample', or else of the latest sample before it"
+
+  def __init__(self, ping_count=3):
+    telemetry.Sources.__init__(self, fixture('sample-1'), ping_count)
+    self.sample = 1
+
+  def read(self, name, command):
+    for sample in range(self.sample, 0, -1):
+      if os.path.exists(fixture('sample-%d' % sample, name)):
+        return read_sample(sample, name)
+    return ''
+
+
+def values(points, name):
+  "{Tunnel or Peer: value} of the points of metric 'name'"
+  result = {}
+  for point_name, dimensions, value, unit in points:
+    if point_name == name:
+      result[dimensions.get('Tunnel', dimensions.get('Peer'))] = value
+  return result
+
+
+class ParserTest(unittest.TestCase):
+  def test_net_dev(self):
+    interfaces = telemetry.parse_net_dev(read_sample(1, 'net-dev'))
+    self.assertEqual(sorted(interfaces), ['vti1', 'vti2'])
+    self.assertEqual(interfaces['vti1'], {
+      'RxBytes': 100000, 'RxPackets': 1000, 'RxErrors': 0, 'RxDrops': 2,
+      'TxBytes': 200000, 'TxPackets': 1500, 'TxErrors': 0, 'TxDrops': 1,
+    })
+
+  def test_ip_addresses(self):
+    addresses = telemetry.parse_ip_addresses(read_sample(1, 'ip-address'))
+    self.assertEqual(addresses['vti1'], '169.254.1.2/30')
+    self.assertEqual(addresses['vti2'], '169.254.1.6/30')
+    self.assertEqual(addresses['eth0'], '192.168.230.10/25')
+
+  def test_ipsec_status(self):
+    peers = telemetry.parse_ipsec_status(read_sample(1, 'ipsec-statusall'))
+    self.assertEqual(peers['1.2.3.4'], {'ike_ids': ['3'],
+      'ike_state': 'ESTABLISHED', 'child_spis': ['c1a2b3c4'],
+      'child_state': 'INSTALLED'})
+    self.assertEqual(peers['1.2.3.5'], {'ike_ids': ['4'],
+      'ike_state': 'CONNECTING', 'child_spis': [], 'child_state': None})
+
+  def test_bgp_summary(self):
+    neighbors = telemetry.parse_bgp_summary(read_sample(1, 'bgp-summary'))
+    self.assertEqual(neighbors['169.254.1.1'], {'as': '7224',
+      'up_down': '00:22:10', 'established': True, 'prefixes': 2,
+      'state': 'Established'})
+    self.assertEqual(neighbors['169.254.1.5'], {'as': '7224',
+      'up_down': 'never', 'established': False, 'prefixes': None,
+      'state': 'Active'})
+
+  def test_ping(self):
+    self.assertEqual(telemetry.parse_ping(read_sample(1, 'ping-vti1')),
+      (0.0, 11.502))
+    self.assertEqual(telemetry.parse_ping(read_sample(1, 'ping-vti2')),
+      (100.0, None))
+    self.assertEqual(telemetry.parse_ping(''), (100.0, None))
+
+  def test_tunnel_peer_address(self):
+    self.assertEqual(telemetry.tunnel_peer_address('169.254.1.2/30'),
+      '169.254.1.1')
+    self.assertEqual(telemetry.tunnel_peer_address('169.254.1.3/31'),
+      '169.254.1.2')
+    # the network address of a /30 isn't a tunnel end
+    self.assertEqual(telemetry.tunnel_peer_address('169.254.1.0/30'), None)
+    self.assertEqual(telemetry.tunnel_peer_address('10.0.0.1/24'), None)
+
+
+class CollectorTest(unittest.TestCase):
+  def setUp(self):
+    self.samples = Samples()
+    self.collector = telemetry.Collector('ohio', self.samples)
+
+  def sample(self, sample, now):
+    self.samples.sample = sample
+    return self.collector.sample(now)
+
+  def test_first_sample(self):
+    points = self.sample(1, 100)
+    # counters and rekeys are changes, there is nothing to compare with yet
+    self.assertEqual(values(points, 'RxBytes'), {})
+    self.assertEqual(values(points, 'ChildSaRekeys'), {})
+    self.assertEqual(values(points, 'IpsecUp'),
+      {'1.2.3.4': 1, '1.2.3.5': 0})
+    self.assertEqual(values(points, 'BgpEstablished'),
+      {'vti1': 1, 'vti2': 0})
+    self.assertEqual(values(points, 'BgpPrefixes'), {'vti1': 2, 'vti2': 0})
+    self.assertEqual(values(points, 'PacketLoss'),
+      {'vti1': 0.0, 'vti2': 100.0})
+    self.assertEqual(values(points, 'Rtt'), {'vti1': 11.502})
+    for name, dimensions, value, unit in points:
+      self.assertEqual(dimensions['VPC'], 'ohio')
+
+  def test_counter_deltas(self):
+    self.sample(1, 100)
+    points = self.sample(2, 160)
+    self.assertEqual(values(points, 'RxBytes'), {'vti1': 500, 'vti2': 100})
+    self.assertEqual(values(points, 'TxPackets'), {'vti1': 8, 'vti2': 0})
+    self.assertEqual(values(points, 'RxDrops'), {'vti1': 0, 'vti2': 0})
+    units = set((name, unit) for name, dimensions, value, unit in points
+      if name in ('RxBytes', 'RxPackets'))
+    self.assertEqual(units, set([('RxBytes', 'Bytes'),
+      ('RxPackets', 'Count')]))
+
+  def test_counter_reset(self):
+    self.sample(2, 100)
+    # lower counters than before: the interface was re-created
+    points = self.sample(1, 160)
+    self.assertEqual(values(points, 'RxBytes'),
+      {'vti1': 100000, 'vti2': 50000})
+
+  def test_rekeys(self):
+    self.sample(1, 100)
+    points = self.sample(2, 160)
+    self.assertEqual(values(points, 'ChildSaRekeys'),
+      {'1.2.3.4': 1, '1.2.3.5': 0})
+    self.assertEqual(values(points, 'IkeSaRekeys'),
+      {'1.2.3.4': 0, '1.2.3.5': 0})
+
+  def test_flap_and_convergence(self):
+    self.sample(1, 100)
+    points = self.sample(2, 160)
+    self.assertEqual(values(points, 'BgpFlaps'), {'vti1': 1, 'vti2': 0})
+    self.assertEqual(values(points, 'BgpEstablished'),
+      {'vti1': 0, 'vti2': 0})
+
+    # up again, but the prefixes are still coming in
+    points = self.sample(3, 220)
+    self.assertEqual(values(points, 'BgpFlaps'), {'vti1': 0, 'vti2': 0})
+    self.assertEqual(values(points, 'BgpConvergenceTime'), {})
+    points = self.sample(4, 280)
+    self.assertEqual(values(points, 'BgpConvergenceTime'), {})
+
+    # converged once they stop changing, timed from the flap
+    points = self.sample(4, 340)
+    self.assertEqual(values(points, 'BgpConvergenceTime'), {'vti1': 180})
+    points = self.sample(4, 400)
+    self.assertEqual(values(points, 'BgpConvergenceTime'), {})
+
+  def test_never_established_not_converging(self):
+    # vti2's session was never up, so it neither flaps nor converges
+    for now in (100, 160, 220):
+      points = self.sample(1, now)
+      self.assertEqual(values(points, 'BgpFlaps')['vti2'], 0)
+      self.assertEqual(values(points, 'BgpConvergenceTime'), {})
+
+  def test_no_pings(self):
+    self.collector = telemetry.Collector('ohio', Samples(ping_count=0))
+    points = self.collector.sample(100)
+    self.assertEqual(values(points, 'PacketLoss'), {})
+    self.assertEqual(values(points, 'Rtt'), {})
+
+
+class SinkTest(unittest.TestCase):
+  BATCH = [
+    (100, 'Rtt', {'VPC': 'ohio', 'Tunnel': 'vti1'}, 11.5, 'Milliseconds'),
+    (100, 'IpsecUp', {'VPC': 'ohio', 'Peer': '1.2.3.4'}, 1, 'None'),
+  ]
+
+  def test_file(self):
+    directory = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(directory, 'metrics')
+      sink = telemetry.create_sink('file:' + filename, 'Thermal/WAN', None)
+      sink.send(self.BATCH)
+      sink.send(self.BATCH[:1])
+      lines = open(filename).read().splitlines()
+    finally:
+      shutil.rmtree(directory)
+    self.assertEqual(len(lines), 2)
+    batch = json.loads(lines[0])
+    self.assertEqual(batch['namespace'], 'Thermal/WAN')
+    self.assertEqual(batch['metrics'][0],
+      [100, 'Rtt', {'VPC': 'ohio', 'Tunnel': 'vti1'}, 11.5, 'Milliseconds'])
+
+  def test_statsd(self):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+    try:
+      sink = telemetry.create_sink('statsd:127.0.0.1:%d' %
+        receiver.getsockname()[1], 'Thermal/WAN', None)
+      sink.send(self.BATCH)
+      packet = receiver.recv(telemetry.STATSD_PACKET_SIZE)
+    finally:
+      receiver.close()
+    self.assertEqual(packet.split('\n'), [
+      'Thermal.WAN.ohio.vti1.Rtt:11.5|g',
+      'Thermal.WAN.ohio.1_2_3_4.IpsecUp:1|g',
+    ])
+
+  def test_statsd_packets(self):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+    try:
+      sink = telemetry.create_sink('statsd:127.0.0.1:%d' %
+        receiver.getsockname()[1], 'Thermal/WAN', None)
+      sink.send(self.BATCH * 100)
+      lines = []
+      while len(lines) < 200:
+        packet = receiver.recv(65536)
+        self.assertTrue(len(packet) <= telemetry.STATSD_PACKET_SIZE)
+        lines.extend(packet.split('\n'))
+    finally:
+      receiver.close()
+    self.assertEqual(len(lines), 200)
+
+  def test_unknown(self):
+    self.assertRaises(ValueError, telemetry.create_sink, 'graphite',
+      'Thermal/WAN', None)
+
+
+class CommandLineTest(unittest.TestCase):
+  def setUp(self):
+    # no stack-config.yaml: the defaults
+    self.config_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.config_dir)
+
+  def run_telemetry(self, *arguments):
+    process = subprocess.Popen([sys.executable,
+      script_path('tunnel-telemetry'), '--config-dir', self.config_dir] +
+      list(arguments), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+    self.assertEqual(process.returncode, 0, errors)
+    return output, errors
+
+  def test_disabled_by_default(self):
+    output, errors = self.run_telemetry('--from-dir', fixture('sample-1'),
+      '--samples', '1')
+    self.assertEqual(output, '')
+    self.assertTrue('disabled' in errors)
+
+  def test_from_dir(self):
+    output, errors = self.run_telemetry('--from-dir', fixture('sample-1'),
+      '--sink', 'file:-', '--samples', '1', '--vpc', 'ohio')
+    batch = json.loads(output)
+    points = [tuple(point[1:]) for point in batch['metrics']]
+    self.assertEqual(values(points, 'Rtt'), {'vti1': 11.502})
+    self.assertEqual(values(points, 'IpsecUp'), {'1.2.3.4': 1, '1.2.3.5': 0})
+
+
+if __name__ == '__main__':
+  unittest.main()